@@ -0,0 +1,220 @@
+"""A local stand-in for the OpenCare site and API, for benchmarks.
+
+Serves, from one HTTP server:
+    /oc-sitemap-doctor-N.xml    sitemap shards listing the fake providers
+    /provider/dr-bench-<id>/    provider pages embedding the page state
+    /doctor?id=<id>             API responses
+
+Provider records are the fixtures of output_data/raw_data, reused
+round-robin under synthetic IDs, so any number of providers can be served.
+Latency and error rates are configurable and the errors are seeded, so
+runs are repeatable.
+"""
+import os
+import json
+import time
+import random
+import threading
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_FIXTURES = os.path.join(REPO_ROOT, "output_data", "raw_data")
+FIRST_ID = 90000000000
+PROFILE_KEY = "src/containers/pages/health/doctors/profile/profile.js"
+
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html><head><title>{name}</title>
+<script>window.isUSVisitor = true;</script>
+<script>window['__PAGE_CONTEXT_QUERY_STATE__'] = {state};</script>
+</head><body><h1>{name}</h1>{filler}</body></html>
+"""
+
+
+def load_fixtures(directory):
+    fixtures = []
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".json"):
+            with open(os.path.join(directory, name), "rb") as f:
+                fixtures.append(f.read())
+    if not fixtures:
+        raise ValueError(f"No provider_<id>.json fixtures in {directory}")
+    return fixtures
+
+
+class FakeOpenCare:
+    def __init__(self, fixtures_dir=DEFAULT_FIXTURES, providers=1000, urls_per_shard=500,
+                 latency=0.0, jitter=0.0, error_rate=0.0, error_status=503, seed=0,
+                 host="127.0.0.1", port=0, page_padding=20000):
+        self.providers = providers
+        self.urls_per_shard = urls_per_shard
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.host = host
+        self.port = port
+        self.requests = 0
+        self.errors = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+
+        # Serialized once; requests only pick and send bytes
+        self.api_bodies = load_fixtures(fixtures_dir)
+        self.page_bodies = []
+        filler = "<div>" + "x" * page_padding + "</div>"
+        for body in self.api_bodies:
+            record = json.loads(body)
+            doctor = record[0] if isinstance(record, list) else record
+            state = json.dumps({PROFILE_KEY: {"data": {"context": {"doctor": doctor}}}})
+            self.page_bodies.append(
+                PAGE_TEMPLATE.format(name=doctor.get("name", ""), state=state, filler=filler).encode("utf-8")
+            )
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}"
+
+    @property
+    def api_url(self):
+        return self.base_url + "/doctor?id={provider_id}"
+
+    @property
+    def shard_count(self):
+        return -(-self.providers // self.urls_per_shard)
+
+    def provider_url(self, index):
+        return f"{self.base_url}/provider/dr-bench-{FIRST_ID + index}/"
+
+    def sitemap(self, shard):
+        start = shard * self.urls_per_shard
+        end = min(self.providers, start + self.urls_per_shard)
+        entries = "".join(
+            f"<url><loc>{self.provider_url(i)}</loc><lastmod>2024-01-01</lastmod></url>"
+            for i in range(start, end)
+        )
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">' + entries + "</urlset>"
+        ).encode("utf-8")
+
+    def _provider_index(self, provider_id):
+        index = int(provider_id) - FIRST_ID
+        return index if 0 <= index < self.providers else None
+
+    def _should_fail(self):
+        with self._lock:
+            self.requests += 1
+            if self.error_rate and self._rng.random() < self.error_rate:
+                self.errors += 1
+                return True
+        return False
+
+    def _delay(self):
+        if self.latency or self.jitter:
+            with self._lock:
+                jitter = self._rng.uniform(0, self.jitter)
+            time.sleep(self.latency + jitter)
+
+    def sitemap_etag(self, shard):
+        return f'"{shard}-{self.providers}-{self.urls_per_shard}"'
+
+    def handle(self, method, path, if_none_match=None):
+        """Returns (status, headers, body) for one request.
+
+        Sitemap shards carry an ETag and answer a matching If-None-Match
+        with 304, like the real sitemaps do for incremental crawls.
+        """
+        url = urlsplit(path)
+        if url.path.startswith("/oc-sitemap-doctor-") and url.path.endswith(".xml"):
+            shard = int(url.path[len("/oc-sitemap-doctor-"):-len(".xml")])
+            if shard >= self.shard_count:
+                return 404, {"Content-Type": "text/plain"}, b"Not Found"
+            headers = {"Content-Type": "application/xml", "ETag": self.sitemap_etag(shard)}
+            if if_none_match == headers["ETag"]:
+                return 304, headers, b""
+            return 200, headers, b"" if method == "HEAD" else self.sitemap(shard)
+
+        if url.path.startswith("/provider/"):
+            index = self._provider_index(url.path.rstrip("/").rsplit("-", 1)[-1])
+            bodies, content_type = self.page_bodies, "text/html; charset=utf-8"
+        elif url.path == "/doctor":
+            index = self._provider_index(parse_qs(url.query).get("id", ["-1"])[0])
+            bodies, content_type = self.api_bodies, "application/json"
+        else:
+            return 404, {"Content-Type": "text/plain"}, b"Not Found"
+
+        self._delay()
+        if index is None:
+            return 404, {"Content-Type": "text/plain"}, b"Not Found"
+        if self._should_fail():
+            headers = {"Content-Type": "text/plain"}
+            if self.error_status in (429, 503):
+                headers["Retry-After"] = "0"
+            return self.error_status, headers, b"Service Unavailable"
+        return 200, {"Content-Type": content_type}, bodies[index % len(bodies)]
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _respond(self, method):
+                status, headers, body = fake.handle(method, self.path, self.headers.get("If-None-Match"))
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if method != "HEAD":
+                    self.wfile.write(body)
+
+            def do_GET(self):
+                self._respond("GET")
+
+            def do_HEAD(self):
+                self._respond("HEAD")
+
+        ThreadingHTTPServer.request_queue_size = 1024
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self.base_url
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the fake OpenCare server until interrupted.")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--providers", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--error_rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    with FakeOpenCare(providers=args.providers, latency=args.latency, error_rate=args.error_rate, port=args.port) as fake:
+        print(f"Serving {args.providers} providers on {fake.base_url} (API: {fake.api_url})")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
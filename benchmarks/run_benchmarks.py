@@ -0,0 +1,198 @@
+"""Benchmarks the crawl stages against the local stand-in server.
+
+    python -m benchmarks.run_benchmarks --providers 2000 --latency 0.005
+    python -m benchmarks.run_benchmarks --bench fetch --engine async --json results.json
+
+Stages run in order on one scratch directory: "sitemap" discovers the
+provider URLs, "fetch" downloads them and "format" formats the raw data.
+Each stage runs in a fresh child process so its peak RSS and CPU time are
+its own; the server runs in this process. Numbers are the median of
+--repeat runs.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import resource
+import statistics
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_opencare import FakeOpenCare
+
+BENCHMARKS = ("sitemap", "fetch", "format")
+
+
+def _usage():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        "cpu_seconds": own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime,
+        # Linux reports kilobytes; formatter pool workers count as children
+        "peak_rss_mb": max(own.ru_maxrss, children.ru_maxrss) / 1024,
+    }
+
+
+def _count_lines(path):
+    with open(path) as f:
+        return sum(1 for line in f if line.strip())
+
+
+def bench_sitemap(work_dir, base_url, options):
+    from functions.search import SitemapFetcher
+
+    with SitemapFetcher(["doctor"], output_dir=work_dir, base_url=base_url) as fetcher:
+        fetcher.fetch_and_save_sitemaps()
+    return _count_lines(fetcher.output_file)
+
+
+def bench_fetch(work_dir, base_url, options):
+    from functions.rate_limiter import RateLimiter
+    from functions.retry import RetryPolicy
+    from functions.checkpoint import open_checkpoint, SUCCESS
+    from functions.fetch_data_bulk import FetchSettings, fetch_all_data, read_urls, extract_provider_id
+    from functions.fetch_data_async import fetch_all_data_async
+    from functions.projection import FORMAT_PROJECTION
+
+    urls = read_urls(os.path.join(work_dir, "providers_urls.txt"))
+    # The benchmark measures the pipeline, not the politeness budget
+    rate_limiter = RateLimiter(rate=1e6, burst=1e6)
+    retry_policy = RetryPolicy(base_delay=0.05, max_delay=1.0)
+    settings = FetchSettings(
+        work_dir, rate_limiter, options["html"], options["storage"], retry_policy=retry_policy,
+        source=options["source"], api_url=base_url + "/doctor?id={provider_id}",
+        projection=None if options["full_archive"] else FORMAT_PROJECTION,
+    )
+    if options["engine"] == "async":
+        fetch_all_data_async(urls, settings, options["threads"], options["threads"])
+    else:
+        fetch_all_data(urls, settings, options["threads"])
+    with open_checkpoint(work_dir, extract_provider_id) as checkpoint:
+        return checkpoint.counts().get(SUCCESS, 0)
+
+
+def bench_format(work_dir, base_url, options):
+    from functions.mpc_formatter import JSONFormatter, MANIFEST_FILE
+    from functions.projection import FORMAT_PROJECTION
+
+    # Start from nothing formatted, or the manifest would skip every record
+    shutil.rmtree(os.path.join(work_dir, "formatted"), ignore_errors=True)
+    manifest = os.path.join(work_dir, MANIFEST_FILE)
+    if os.path.exists(manifest):
+        os.remove(manifest)
+    formatter = JSONFormatter(work_dir, mode=options["format_mode"], storage=options["storage"],
+                              projection=FORMAT_PROJECTION)
+    formatter.process_directory()
+    return len(os.listdir(formatter.formatted_dir))
+
+
+def _run_in_child(name, work_dir, base_url, options):
+    if not options["verbose"]:
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, 1)
+        os.dup2(devnull, 2)
+    bench = globals()[f"bench_{name}"]
+    started = time.perf_counter()
+    items = bench(work_dir, base_url, options)
+    seconds = time.perf_counter() - started
+    return dict(items=items, seconds=seconds, **_usage())
+
+
+def run_stage(name, work_dir, base_url, options):
+    # spawn: the child starts clean instead of inheriting this process's memory and server threads
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(_run_in_child, name, work_dir, base_url, options).result()
+
+
+def _median(runs):
+    result = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+    result["items_per_second"] = result["items"] / result["seconds"] if result["seconds"] else None
+    result["runs"] = len(runs)
+    return result
+
+
+def _reset(work_dir, name):
+    """Removes what a previous run of the stage left, so every repeat does the full work."""
+    if name == "fetch":
+        for entry in ("raw_data", "html_data", "checkpoint.db", "checkpoint.db-wal", "checkpoint.db-shm"):
+            path = os.path.join(work_dir, entry)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.exists(path):
+                os.remove(path)
+    elif name == "sitemap":
+        for entry in ("progress.json", "sitemap_lastmod.db"):
+            path = os.path.join(work_dir, entry)
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def print_table(results):
+    header = f"{'stage':<10}{'items':>10}{'seconds':>10}{'items/s':>12}{'cpu s':>10}{'peak MB':>10}"
+    print(header)
+    print("-" * len(header))
+    for name, r in results.items():
+        print(f"{name:<10}{r['items']:>10.0f}{r['seconds']:>10.2f}{r['items_per_second'] or 0:>12.1f}"
+              f"{r['cpu_seconds']:>10.2f}{r['peak_rss_mb']:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sitemap discovery, fetching and formatting against a local fake OpenCare.")
+    parser.add_argument('--bench', nargs="+", choices=BENCHMARKS, default=list(BENCHMARKS), help="Stages to time; earlier stages still run once to produce their input.")
+    parser.add_argument('--providers', type=int, default=1000, help="Number of fake providers.")
+    parser.add_argument('--urls_per_shard', type=int, default=500, help="Provider URLs per sitemap shard.")
+    parser.add_argument('--latency', type=float, default=0.0, help="Server delay per provider request in seconds.")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Extra random delay of up to this many seconds.")
+    parser.add_argument('--error_rate', type=float, default=0.0, help="Fraction of provider requests answered with --error_status.")
+    parser.add_argument('--error_status', type=int, default=503, help="Status of the injected errors.")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the injected latency and errors.")
+    parser.add_argument('--engine', choices=["threads", "async"], default="threads", help="Fetch engine.")
+    parser.add_argument('--threads', type=int, default=32, help="Fetch threads (or async concurrency).")
+    parser.add_argument('--source', choices=["api", "page"], default="api", help="Fetch provider data from the API or the page.")
+    parser.add_argument('--html', choices=["pretty", "raw", "none"], default="none", help="How fetched pages are saved.")
+    parser.add_argument('--storage', choices=["files", "shards"], default="files", help="Raw data storage.")
+    parser.add_argument('--full_archive', action="store_true", help="Store complete API responses instead of the projected fields.")
+    parser.add_argument('--format_mode', choices=["threads", "processes"], default="threads", help="Formatter execution mode.")
+    parser.add_argument('--repeat', type=int, default=1, help="Runs per stage; the median is reported.")
+    parser.add_argument('--work_dir', help="Scratch directory (default: a temporary one, removed afterwards).")
+    parser.add_argument('--json', help="Also write the results to this JSON file.")
+    parser.add_argument('--verbose', action="store_true", help="Show the stages' own output.")
+    args = parser.parse_args()
+
+    options = vars(args)
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="opencare-bench-")
+    os.makedirs(work_dir, exist_ok=True)
+    results = {}
+    try:
+        with FakeOpenCare(providers=args.providers, urls_per_shard=args.urls_per_shard, latency=args.latency,
+                          jitter=args.jitter, error_rate=args.error_rate, error_status=args.error_status,
+                          seed=args.seed) as server:
+            last = max(BENCHMARKS.index(name) for name in args.bench)
+            for name in BENCHMARKS[:last + 1]:
+                repeats = args.repeat if name in args.bench else 1
+                runs = []
+                for _ in range(repeats):
+                    _reset(work_dir, name)
+                    runs.append(run_stage(name, work_dir, server.base_url, options))
+                if name in args.bench:
+                    results[name] = _median(runs)
+            server_stats = {"requests": server.requests, "injected_errors": server.errors}
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_table(results)
+    print(f"Server: {server_stats['requests']} provider requests, {server_stats['injected_errors']} injected errors.")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"options": options, "server": server_stats, "results": results}, f, indent=4)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
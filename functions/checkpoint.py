@@ -0,0 +1,163 @@
+import os
+import time
+import threading
+from functions.sqlite_batch import BatchedWriter, connect
+
+SUCCESS = "success"
+FAILED = "failed"
+
+_UPSERT = """
+    INSERT INTO checkpoints (provider_id, status, attempts, url, updated_at)
+    VALUES (?, ?, 1, ?, ?)
+    ON CONFLICT(provider_id) DO UPDATE SET
+        status = excluded.status,
+        attempts = attempts + 1,
+        url = excluded.url,
+        updated_at = excluded.updated_at
+"""
+
+# PRAGMA user_version once the legacy progress.txt has been imported
+LEGACY_IMPORTED = 1
+
+
+class CheckpointStore:
+    """Crash-safe resume state for the crawl, keyed by provider ID.
+
+    Results are buffered and written in batched transactions, so a crash can
+    only lose the last uncommitted batch (those providers are fetched again)
+    and never leaves the store half-written. Lookups hit the primary key
+    index, so resuming does not load the completed set into memory.
+    """
+
+    def __init__(self, path, batch_size=500, flush_interval=5.0):
+        self.path = path
+        self.conn = connect(path)
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS checkpoints (
+                provider_id INTEGER PRIMARY KEY,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                url TEXT,
+                updated_at REAL
+            )"""
+        )
+        self.conn.commit()
+        self._writer = BatchedWriter(self.conn, _UPSERT, batch_size, flush_interval)
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def is_done(self, provider_id, since=None):
+        """True if the provider was fetched successfully (at or after `since`, if given)."""
+        query = "SELECT 1 FROM checkpoints WHERE provider_id = ? AND status = ?"
+        params = (int(provider_id), SUCCESS)
+        if since is not None:
+            query += " AND updated_at >= ?"
+            params += (since,)
+        with self._lock:
+            row = self.conn.execute(query, params).fetchone()
+        return row is not None
+
+    def success_times(self, provider_ids):
+        """Maps each of `provider_ids` that was fetched successfully to its last success time."""
+        provider_ids = [int(provider_id) for provider_id in provider_ids]
+        times = {}
+        with self._lock:
+            # Stay well under SQLite's limit on bound parameters
+            for start in range(0, len(provider_ids), 500):
+                chunk = provider_ids[start:start + 500]
+                times.update(self.conn.execute(
+                    f"SELECT provider_id, updated_at FROM checkpoints WHERE status = ? AND provider_id IN ({','.join('?' * len(chunk))})",
+                    [SUCCESS] + chunk,
+                ))
+        return times
+
+    def pending(self, urls, extract_id, since=None, on_skip=None):
+        """Lazily yields the URLs whose provider is not done yet (see is_done).
+
+        `urls` may be a generator (see read_urls); every URL is checked
+        against the indexed store instead of an in-memory set of completed
+        URLs. on_skip(url) is called for each URL left out.
+        """
+        for url in urls:
+            provider_id = extract_id(url)
+            if not (provider_id and self.is_done(provider_id, since)):
+                yield url
+            elif on_skip:
+                on_skip(url)
+
+    def successes(self, urls, extract_id, since=None):
+        """Yields (provider_id, url, updated_at) for each of `urls` that is done (see is_done)."""
+        by_id = {}
+        for url in urls:
+            provider_id = extract_id(url)
+            if provider_id:
+                by_id[int(provider_id)] = url
+        for provider_id, updated_at in self.success_times(by_id).items():
+            if since is None or updated_at >= since:
+                yield provider_id, by_id[provider_id], updated_at
+
+    def record(self, provider_id, url, success, updated_at=None):
+        with self._lock:
+            self._writer.add((int(provider_id), SUCCESS if success else FAILED, url, updated_at or time.time()))
+
+    def flush(self):
+        with self._lock:
+            self._writer.flush()
+
+    def counts(self):
+        with self._lock:
+            return dict(
+                self.conn.execute("SELECT status, COUNT(*) FROM checkpoints GROUP BY status")
+            )
+
+    @property
+    def legacy_imported(self):
+        with self._lock:
+            return self.conn.execute("PRAGMA user_version").fetchone()[0] >= LEGACY_IMPORTED
+
+    def import_progress_file(self, progress_file, extract_id):
+        """Migrates a legacy progress.txt (one completed URL per line) into the store.
+
+        Providers the store already has a result for keep it, since it is
+        newer than the legacy file.
+        """
+        now = time.time()
+
+        def rows():
+            with open(progress_file, "r") as f:
+                for line in f:
+                    url = line.strip()
+                    provider_id = extract_id(url) if url else None
+                    if provider_id:
+                        yield (int(provider_id), SUCCESS, url, now)
+
+        # One transaction with the marker, so an interrupted import is simply redone
+        with self._lock, self.conn:
+            imported = self.conn.executemany(
+                "INSERT OR IGNORE INTO checkpoints (provider_id, status, attempts, url, updated_at) VALUES (?, ?, 1, ?, ?)",
+                rows(),
+            ).rowcount
+            self.conn.execute(f"PRAGMA user_version = {LEGACY_IMPORTED}")
+        return imported
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+
+def open_checkpoint(output_directory, extract_id):
+    """Opens output_directory/checkpoint.db, importing a legacy progress.txt until one import completes."""
+    os.makedirs(output_directory, exist_ok=True)
+    store = CheckpointStore(os.path.join(output_directory, "checkpoint.db"))
+    progress_file = os.path.join(output_directory, "progress.txt")
+    if not store.legacy_imported and os.path.exists(progress_file):
+        imported = store.import_progress_file(progress_file, extract_id)
+        print(f"Imported {imported} completed URLs from {progress_file}.")
+    print(f"Checkpoint state: {store.counts() or 'empty'}")
+    return store
+
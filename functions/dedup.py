@@ -0,0 +1,102 @@
+import os
+import heapq
+from array import array
+from bisect import bisect_left
+from urllib.parse import urlsplit, urlunsplit
+from functions.fetch_data_bulk import extract_provider_id, read_urls
+
+
+def normalize_url(url):
+    """Canonical form of a provider URL: no query or fragment, trailing slash on the path."""
+    scheme, netloc, path, _, _ = urlsplit(url.strip())
+    if not path.endswith("/"):
+        path += "/"
+    return urlunsplit((scheme, netloc.lower(), path, "", ""))
+
+
+def _sorted_unique(values):
+    unique = array("Q")
+    for value in values:
+        if not unique or unique[-1] != value:
+            unique.append(value)
+    return unique
+
+
+def collect_provider_ids(urls, chunk_size=1 << 20):
+    """Returns the sorted, de-duplicated provider IDs of `urls` as an array('Q').
+
+    IDs are sorted in chunks and merged, so besides the 8 bytes per ID of
+    the arrays only one chunk is ever held as Python ints.
+    """
+    chunks = []
+    chunk = array("Q")
+    for url in urls:
+        provider_id = extract_provider_id(normalize_url(url))
+        if provider_id:
+            chunk.append(int(provider_id))
+            if len(chunk) >= chunk_size:
+                chunks.append(_sorted_unique(sorted(chunk)))
+                chunk = array("Q")
+    chunks.append(_sorted_unique(sorted(chunk)))
+    return _sorted_unique(heapq.merge(*chunks))
+
+
+class ProviderIndex:
+    """A sorted array of provider IDs with a bitmap of the ones already emitted."""
+
+    def __init__(self, provider_ids):
+        self.ids = provider_ids
+        self.emitted = bytearray((len(provider_ids) + 7) // 8)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def position(self, provider_id):
+        i = bisect_left(self.ids, provider_id)
+        return i if i < len(self.ids) and self.ids[i] == provider_id else None
+
+    def first_time(self, provider_id):
+        """True the first time a known provider is seen, False afterwards (and for unknown IDs)."""
+        i = self.position(provider_id)
+        if i is None:
+            return False
+        byte, bit = divmod(i, 8)
+        if self.emitted[byte] & (1 << bit):
+            return False
+        self.emitted[byte] |= 1 << bit
+        return True
+
+
+def unique_provider_urls(urls_file, counts=None):
+    """Yields one normalized URL per provider ID, in input order, in two passes over the file.
+
+    The same provider can appear under several slugs, with and without a
+    trailing slash, or in both the doctor and clinic sitemaps; it is fetched
+    once, from its first URL. URLs without a provider ID are dropped.
+    `counts`, if given, receives the number of input URLs.
+    """
+    index = ProviderIndex(collect_provider_ids(read_urls(urls_file)))
+    total = 0
+    for url in read_urls(urls_file):
+        total += 1
+        url = normalize_url(url)
+        provider_id = extract_provider_id(url)
+        if provider_id and index.first_time(int(provider_id)):
+            yield url
+    if counts is not None:
+        counts["urls"] = total
+
+
+def dedupe_url_file(urls_file, output_file=None):
+    """Writes the unique provider URLs of `urls_file` next to it and returns the new path."""
+    if output_file is None:
+        root, ext = os.path.splitext(urls_file)
+        output_file = f"{root}_unique{ext or '.txt'}"
+    counts = {}
+    unique = 0
+    with open(output_file, "w") as f:
+        for url in unique_provider_urls(urls_file, counts):
+            f.write(url + "\n")
+            unique += 1
+    print(f"Deduplicated {counts['urls']} URLs to {unique} unique providers in {output_file}.")
+    return output_file
@@ -0,0 +1,143 @@
+import time
+import asyncio
+from tqdm import tqdm
+from functions.fetch_data_bulk import (
+    Fetcher, extract_provider_id, record_request, record_outcome, record_error, report_finished,
+)
+from functions.metrics import metrics
+from functions.checkpoint import open_checkpoint
+from functions.retry import RetryLater, check_response
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+async def _get(session, url, fetcher, headers=None):
+    """Rate-limited GET, optionally through the fetcher's proxy pool; returns the body bytes."""
+    rate_limiter, proxy_pool = fetcher.rate_limiter, fetcher.proxy_pool
+    proxy = proxy_pool.acquire() if proxy_pool else None
+    via = proxy.name if proxy else None
+    request_url, params, proxy_url = url, None, None
+    if proxy:
+        request_url, params, proxies = proxy.request_args(url)
+        proxy_url = proxies and proxies["http"]
+    await rate_limiter.wait_async(url, via)
+    start = time.perf_counter()
+    try:
+        async with session.get(request_url, params=params, proxy=proxy_url, headers=headers) as response:
+            content = await response.read()
+    except Exception as e:
+        record_request(url, start, error=e)
+        if proxy:
+            proxy_pool.release(proxy, error=e)
+        raise
+    if proxy:
+        proxy_pool.release(proxy, time.perf_counter() - start, response.status)
+    record_request(url, start, response.status, len(content))
+    rate_limiter.feedback(url, response.status, via)
+    check_response(url, response.status, response.headers)
+    return content
+
+
+async def process_url_async(session, fetcher, url, attempt=0):
+    """Fetcher.process_url over one pooled aiohttp session.
+
+    The record steps are the Fetcher's own; the blocking ones (HTML
+    parsing, page extraction, store writes, a full formatter queue) run in
+    threads so they never stall the event loop. Like Fetcher.process_url
+    it raises RetryLater for failures worth retrying.
+    """
+    provider_id = fetcher.provider_id(url)
+    if not provider_id:
+        return False
+
+    try:
+        page = api_body = None
+        if fetcher.settings.needs_page:
+            page = await _get(session, url, fetcher, fetcher.headers)
+            await asyncio.to_thread(fetcher.save_html, provider_id, url, page)
+        if fetcher.settings.source != "page":
+            api_body = await _get(session, fetcher.api_request_url(provider_id), fetcher)
+        data = await asyncio.to_thread(fetcher.extract, page, api_body)
+        await asyncio.to_thread(fetcher.deliver, provider_id, data)
+        return True
+    except Exception as e:
+        return fetcher.retry_or_give_up(url, attempt, e)
+
+
+async def _fetch_all(urls, settings, concurrency, connections_per_host, total):
+    checkpoint = open_checkpoint(settings.output_directory, extract_provider_id)
+    fetcher = Fetcher(settings)
+
+    # Workers pull from a bounded queue, so only `concurrency` URLs are in flight
+    # while the connector keeps a keep-alive pool per host.
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+    connector = aiohttp.TCPConnector(
+        limit=concurrency, limit_per_host=connections_per_host, ttl_dns_cache=300
+    )
+    connect_timeout, read_timeout = settings.retry_policy.timeout
+    timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+    # Deferred retries sleep in their own tasks, so workers keep pulling new URLs
+    retry_tasks = set()
+
+    async def retry_later(url, attempt, delay):
+        await asyncio.sleep(delay)
+        await queue.put((url, attempt))
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        with checkpoint, fetcher, tqdm(total=total, desc="Processing URLs") as progress_bar:
+            remaining_urls = checkpoint.pending(
+                urls, extract_provider_id, settings.done_since, on_skip=lambda url: progress_bar.update(1)
+            )
+
+            async def worker():
+                while True:
+                    item = await queue.get()
+                    if item is None:
+                        queue.task_done()
+                        return
+                    url, attempt = item
+                    try:
+                        record_outcome(checkpoint, url, await process_url_async(session, fetcher, url, attempt))
+                        progress_bar.update(1)
+                    except RetryLater as retry:
+                        task = asyncio.create_task(retry_later(url, attempt + 1, retry.delay))
+                        retry_tasks.add(task)
+                        task.add_done_callback(retry_tasks.discard)
+                    except Exception as e:
+                        record_error(url, e)
+                        progress_bar.update(1)
+                    finally:
+                        queue.task_done()
+
+            metrics.set_gauge("fetch_queue", queue.qsize)
+            metrics.set_gauge("fetch_retry_tasks", retry_tasks.__len__)
+            workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+            for url in remaining_urls:
+                await queue.put((url, 0))
+            # Once the queue is drained no worker can schedule more retries,
+            # so wait for the pending ones and repeat until none are left
+            while True:
+                await queue.join()
+                if not retry_tasks:
+                    break
+                await asyncio.gather(*retry_tasks)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+
+    metrics.remove_gauge("fetch_queue")
+    metrics.remove_gauge("fetch_retry_tasks")
+    report_finished(settings)
+
+
+def fetch_all_data_async(urls, settings, concurrency=1000, connections_per_host=100, total=None):
+    """Fetches `urls` (any iterable) with asyncio, as configured by a FetchSettings.
+
+    `total` is as for fetch_all_data.
+    """
+    if aiohttp is None:
+        raise ImportError("The async engine requires aiohttp: pip install aiohttp")
+    asyncio.run(_fetch_all(urls, settings, concurrency, connections_per_host, total))
@@ -1,12 +1,21 @@
 import os
-import random
 import time
-import json
 import re
+import logging
 import requests
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from tqdm import tqdm
+from functions.rate_limiter import RateLimiter
+from functions.checkpoint import open_checkpoint
+from functions.retry import RetryPolicy, RetryQueue, RetryLater, check_response, classify
+from functions import serializer
+from functions.storage import FileStore, ShardWriter
+from functions.page_state import extract_data
+from functions.projection import project
+from functions.metrics import metrics
+from urllib.parse import urlsplit
 # Set headers to mimic a real browser request
 headers = {
     "User-Agent": (
@@ -20,98 +29,364 @@ headers = {
     "Accept-Encoding": "gzip, deflate, br",
 }
 
-# ScrapeOps Proxy
+# ScrapeOps Proxy, used through ProxyPool.scrapeops (main.py --scrapeops_key)
 scrapeops_api_key = ""
 proxy_url = "https://proxy.scrapeops.io/v1/"
 
-def process_url(url, output_directory):
-    max_retries = 2
-    retry_delay = 15
-    os.makedirs(output_directory, exist_ok=True)
-
-    # Extract ID from URL
-    #for clinic 
-    id_pattern = re.compile(r"-(\d+)[a-z]?/")
-    match = id_pattern.search(url)
-    provider_id = match.group(1) if match else None
-    if not provider_id:
-        print(f"Could not extract ID from URL: {url}")
-        return False
-
-    for attempt in range(max_retries):
-        print(f"Attempt {attempt + 1} of {max_retries}")
-        time.sleep(random.uniform(7, 15))
+API_URL = "https://api.opencare.com/doctor?id={provider_id}"
+
+# Provider and clinic URLs end in "-<id>/" (clinics carry a letter suffix)
+provider_id_pattern = re.compile(r"-(\d+)[a-z]?/")
+unsafe_filename_pattern = re.compile(r"[^\w\-_\. ]")
+
+
+def extract_provider_id(url):
+    match = provider_id_pattern.search(url)
+    return match.group(1) if match else None
+
+
+def html_filename(url):
+    return unsafe_filename_pattern.sub("_", url) + ".html"
+
+
+# Configured by main.setup_logging; without it they fall back to the root logger
+success_logger = logging.getLogger("success_logger")
+error_logger = logging.getLogger("error_logger")
+
+
+def record_request(url, start, status=None, size=0, error=None):
+    """Reports one finished HTTP request (started at perf_counter `start`) to the metrics registry."""
+    host = urlsplit(url).netloc
+    metrics.observe("http_request_seconds", time.perf_counter() - start, host=host)
+    if error is not None:
+        metrics.inc("http_errors", host=host, error=type(error).__name__)
+        return
+    metrics.inc("http_requests", host=host, status=status)
+    # Body size after content decoding; gzip/br responses take fewer bytes on the wire
+    metrics.inc("response_body_bytes", size, host=host)
+
+
+class FetchSettings:
+    """How a crawl fetches providers and where it puts them; shared by both fetch engines.
+
+    html_mode: "pretty" parses and prettifies the page, "raw" stores the
+    response bytes untouched and "none" skips the page request entirely.
+    source="page" takes the provider data embedded in the page instead of
+    calling the API. storage is "files", "shards" or "none" (see
+    open_stores); projection is a functions/projection.py spec, and only
+    those fields are stored and passed on. on_payload(provider_id, data)
+    streams every payload on, e.g. to a FormatPipeline. Providers fetched
+    before done_since are stale and fetched again.
+    """
+
+    def __init__(self, output_directory=None, rate_limiter=None, html_mode="pretty", storage="files",
+                 compact=False, done_since=None, on_payload=None, retry_policy=None, proxy_pool=None,
+                 source="api", api_url=API_URL, projection=None, headers=headers):
+        self.output_directory = output_directory
+        # One limiter shared by every worker keeps the whole crawl within a single budget
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.html_mode = html_mode
+        self.storage = storage
+        self.compact = compact
+        self.done_since = done_since
+        self.on_payload = on_payload
+        self.retry_policy = retry_policy or RetryPolicy()
+        # proxy_pool rotates requests over several proxies
+        self.proxy_pool = proxy_pool
+        self.source = source
+        self.api_url = api_url
+        self.projection = projection
+        self.headers = headers
+
+    @property
+    def needs_page(self):
+        return self.html_mode != "none" or self.source == "page"
+
+
+class Fetcher:
+    """Fetches provider pages and API payloads with one shared, pooled session.
+
+    Everything that used to be rebuilt per URL (connection setup, output
+    directories and stores, headers, retry and proxy settings) is prepared
+    once here, and every worker thread shares the instance. Failures are
+    classified by the RetryPolicy; retryable ones are handed back to the
+    caller as RetryLater instead of sleeping in the worker. The per-record
+    steps (save_html, extract, deliver, retry_or_give_up) are also used by
+    the async engine with its own HTTP client.
+    """
+
+    def __init__(self, settings=None, pool_size=10):
+        self.settings = settings = settings or FetchSettings()
+        self.rate_limiter = settings.rate_limiter
+        self.retry_policy = settings.retry_policy
+        self.proxy_pool = settings.proxy_pool
+        self.headers = settings.headers
+
+        self.session = requests.Session()
+        # One keep-alive pool per host, large enough for every worker thread
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.raw_store = self.html_store = self.html_directory = None
+        if settings.output_directory is not None:
+            os.makedirs(settings.output_directory, exist_ok=True)
+            self.raw_store, self.html_store = open_stores(
+                settings.output_directory, settings.storage, settings.html_mode, settings.compact
+            )
+            if settings.html_mode != "none" and self.html_store is None:
+                self.html_directory = os.path.join(settings.output_directory, "html_data")
+                os.makedirs(self.html_directory, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get(self, url, **kwargs):
+        """Rate-limited GET on the shared session; raises FetchError for error statuses."""
+        kwargs.setdefault("timeout", self.retry_policy.timeout)
+        if self.proxy_pool:
+            return self._get_via_proxy(url, kwargs)
+        if self.rate_limiter:
+            self.rate_limiter.wait(url)
+        start = time.perf_counter()
+        try:
+            response = self.session.get(url, **kwargs)
+        except Exception as e:
+            record_request(url, start, error=e)
+            raise
+        record_request(url, start, response.status_code, len(response.content))
+        if self.rate_limiter:
+            self.rate_limiter.feedback(url, response.status_code)
+        check_response(url, response.status_code, response.headers)
+        return response
+
+    def _get_via_proxy(self, url, kwargs):
+        proxy = self.proxy_pool.acquire()
+        request_url, params, proxies = proxy.request_args(url, kwargs.pop("params", None))
+        if self.rate_limiter:
+            self.rate_limiter.wait(url, via=proxy.name)
+        start = time.perf_counter()
         try:
-            response = requests.get(
-                url= url,
-                headers=headers,
-             )
-            response.raise_for_status()
-            soup = BeautifulSoup(response.content, "html.parser")
-
-            # Save raw HTML content
-            html_filename = re.sub(r"[^\w\-_\. ]", "_", url) + ".html"
-            filepath = os.path.join(output_directory, "html_data", html_filename)
-            with open(filepath, "w", encoding="utf-8") as html_file:
-                html_file.write(soup.prettify())
-            print(f"Raw HTML saved to '{filepath}'")
-
-            # Fetch data from API using the extracted ID
-            api_url = f"https://api.opencare.com/doctor?id={provider_id}"
-            api_response = requests.get(api_url)
-            api_data = api_response.json()
-
-            # Save the extracted data to JSON
-            json_filepath = os.path.join(output_directory, "raw_data", f"provider_{provider_id}.json")
-            with open(json_filepath, "w", encoding="utf-8") as json_file:
-                json.dump(api_data, json_file, ensure_ascii=False, indent=4)
-            print(f"Data successfully saved to {json_filepath}")
+            response = self.session.get(request_url, params=params, proxies=proxies, **kwargs)
+        except Exception as e:
+            self.proxy_pool.release(proxy, error=e)
+            record_request(url, start, error=e)
+            raise
+        self.proxy_pool.release(proxy, time.perf_counter() - start, response.status_code)
+        record_request(url, start, response.status_code, len(response.content))
+        if self.rate_limiter:
+            self.rate_limiter.feedback(url, response.status_code, via=proxy.name)
+        check_response(url, response.status_code, response.headers)
+        return response
+
+    @staticmethod
+    def provider_id(url):
+        provider_id = extract_provider_id(url)
+        if not provider_id:
+            print(f"Could not extract ID from URL: {url}")
+        return provider_id
+
+    def api_request_url(self, provider_id):
+        return self.settings.api_url.format(provider_id=provider_id)
+
+    def fetch_api(self, provider_id):
+        return serializer.loads(self.get(self.api_request_url(provider_id)).content)
+
+    def save_html(self, provider_id, url, content):
+        """Stores the page bytes as html_mode asks; does nothing for html_mode="none"."""
+        html_mode = self.settings.html_mode
+        if html_mode == "none":
+            return
+        if self.html_store:
+            html = content.decode("utf-8", "replace") if html_mode == "raw" else BeautifulSoup(content, "html.parser").prettify()
+            self.html_store.write(provider_id, {"url": url, "html": html})
+            return
+        filepath = os.path.join(self.html_directory, html_filename(url))
+        if html_mode != "raw":
+            content = BeautifulSoup(content, "html.parser").prettify().encode("utf-8")
+        with open(filepath, "wb") as html_file:
+            html_file.write(content)
+        metrics.inc("bytes_written", len(content), store="html_data")
+        print(f"Raw HTML saved to '{filepath}'")
+
+    def extract(self, page=None, api_body=None):
+        """The provider data, from the page or the API response body per `source`, projected."""
+        if self.settings.source == "page":
+            data = extract_data(page)
+        else:
+            data = serializer.loads(api_body)
+        if self.settings.projection is not None:
+            data = project(data, self.settings.projection)
+        return data
 
+    def deliver(self, provider_id, data):
+        # raw_store is None when raw persistence is off
+        if self.raw_store:
+            self.raw_store.write(provider_id, data)
+        # Hand the payload to the streaming formatter, if one is attached
+        if self.settings.on_payload:
+            self.settings.on_payload(provider_id, data)
+
+    def retry_or_give_up(self, url, attempt, error):
+        """Returns False when `error` is final, otherwise raises RetryLater with the backoff."""
+        kind = classify(error)
+        delay = self.retry_policy.next_delay(attempt, error)
+        if delay is None:
+            print(f"Error processing URL {url} ({kind}, attempt {attempt + 1}): {error}. Giving up.")
+            return False
+        metrics.inc("retries", kind=kind)
+        print(f"Error processing URL {url} ({kind}, attempt {attempt + 1}): {error}. Retrying in {delay:.1f} seconds...")
+        raise RetryLater(delay, error)
+
+    def process_url(self, url, attempt=0):
+        """Fetches one provider; True on success, False once it failed for good.
+
+        Raises RetryLater when the failure is worth another attempt.
+        """
+        provider_id = self.provider_id(url)
+        if not provider_id:
+            return False
+
+        try:
+            page = api_body = None
+            if self.settings.needs_page:
+                page = self.get(url, headers=self.headers).content
+                self.save_html(provider_id, url, page)
+            if self.settings.source != "page":
+                api_body = self.get(self.api_request_url(provider_id)).content
+            self.deliver(provider_id, self.extract(page, api_body))
             return True
         except Exception as e:
-            print(f"Error processing URL {url}: {e}")
-            if attempt < max_retries - 1:
-                print(f"Retrying in {retry_delay} seconds...")
-                time.sleep(retry_delay)
-            else:
-                print("Max retries reached. Skipping this URL.")
-                return False
-
-
-def fetch_all_data(urls, output_directory, max_threads=10):
-    completed_urls = set()
-    progress_file = os.path.join(output_directory, "progress.txt")
-
-    # Load previously completed URLs
-    if os.path.exists(progress_file):
-        with open(progress_file, "r") as f:
-            completed_urls = {line.strip() for line in f}
-        print(f"Loaded {len(completed_urls)} completed URLs from {progress_file}.")
+            return self.retry_or_give_up(url, attempt, e)
+
+    def close(self):
+        self.session.close()
+        close_stores(self.raw_store, self.html_store)
+
+
+def record_outcome(checkpoint, url, success):
+    """Books a finished URL (True/False from process_url) in the checkpoint, metrics and logs."""
+    provider_id = extract_provider_id(url)
+    if provider_id:
+        checkpoint.record(provider_id, url, success)
+    metrics.inc("urls_processed", outcome="success" if success else "failed")
+    if success:
+        success_logger.info(f"URL {url} successfully processed.")
     else:
-        print("No progress file found. Starting fresh.")
+        error_logger.error(f"URL {url} failed. Skipping...")
+
+
+def record_error(url, error):
+    """Books a URL whose processing raised something other than RetryLater."""
+    metrics.inc("urls_processed", outcome="error")
+    error_logger.error(f"Error processing URL {url}: {error}")
+
+
+def open_stores(output_directory, storage, html_mode, compact=False):
+    """Returns (raw_store, html_store) for storage "files", "shards" or "none" (no raw data kept).
+
+    html_store is None unless pages go to shards; page files are written by Fetcher.save_html.
+    """
+    raw_directory = os.path.join(output_directory, "raw_data")
+    if storage == "shards":
+        raw_store = ShardWriter(raw_directory)
+        html_store = ShardWriter(os.path.join(output_directory, "html_data")) if html_mode != "none" else None
+        return raw_store, html_store
+    if storage == "none":
+        return None, None
+    return FileStore(raw_directory, indent=None if compact else 2), None
+
+
+def close_stores(*stores):
+    for store in stores:
+        if store:
+            store.close()
+
 
-    remaining_urls = [url for url in urls if url not in completed_urls]
-    print(f"Found {len(remaining_urls)} unprocessed URLs.")
+def read_urls(urls_file):
+    """Lazily yields the non-empty lines of a URL list file."""
+    with open(urls_file, "r") as f:
+        for line in f:
+            url = line.strip()
+            if url:
+                yield url
+
+
+def count_urls(urls_file):
+    """Number of URLs in a URL list file, counted without loading it."""
+    return sum(1 for _ in read_urls(urls_file))
+
+
+def fetch_all_data(urls, settings, max_threads=10, max_in_flight=None, total=None):
+    """Fetches `urls` (any iterable) on a thread pool, as configured by a FetchSettings.
+
+    `total`, the number of URLs if known, gives the progress bar its ETA;
+    URLs that are already done count as progress.
+    """
+    # Only a bounded window of futures exists at any time, whatever the input size
+    max_in_flight = max_in_flight or max_threads * 4
+    checkpoint = open_checkpoint(settings.output_directory, extract_provider_id)
+    fetcher = Fetcher(settings, pool_size=max_threads)
+    # Failed URLs wait here until their backoff expires, without holding a worker
+    retries = RetryQueue()
+
+    with checkpoint, fetcher, tqdm(total=total, desc="Processing URLs") as progress_bar:
+        remaining_urls = checkpoint.pending(
+            urls, extract_provider_id, settings.done_since, on_skip=lambda url: progress_bar.update(1)
+        )
+
+        def handle_result(future, url, attempt):
+            try:
+                record_outcome(checkpoint, url, future.result())
+            except RetryLater as retry:
+                retries.push((url, attempt + 1), retry.delay)
+                return
+            except Exception as e:
+                record_error(url, e)
+            progress_bar.update(1)
 
-    with tqdm(total=len(remaining_urls), desc="Processing URLs") as progress_bar:
         with ThreadPoolExecutor(max_workers=max_threads) as executor:
-            futures = []
+            in_flight = {}
+
+            def submit(url, attempt):
+                in_flight[executor.submit(fetcher.process_url, url, attempt)] = (url, attempt)
+
+            def collect(timeout=None):
+                done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    handle_result(future, *in_flight.pop(future))
+
+            def submit_due_retries():
+                for url, attempt in retries.pop_due(max_in_flight - len(in_flight)):
+                    submit(url, attempt)
+
+            metrics.set_gauge("fetch_in_flight", lambda: len(in_flight))
+            metrics.set_gauge("fetch_retry_queue", retries.__len__)
             for url in remaining_urls:
-                future = executor.submit(process_url, url, output_directory)
-                futures.append((future, url))
-
-            for future, url in futures:
-                try:
-                    success = future.result()
-                    if success:
-                        with open(progress_file, "a") as f:
-                            f.write(f"{url}\n")
-                        print(f"URL {url} successfully processed.")
-                    else:
-                        print(f"URL {url} failed. Skipping...")
-                except Exception as e:
-                    print(f"Error processing URL {url}: {e}")
-                finally:
-                    progress_bar.update(1)
-
-    print("Processing complete.")
\ No newline at end of file
+                while len(in_flight) >= max_in_flight:
+                    collect()
+                submit_due_retries()
+                if len(in_flight) >= max_in_flight:
+                    collect()
+                submit(url, 0)
+
+            # Finish the in-flight URLs and every retry they schedule
+            while in_flight or retries:
+                submit_due_retries()
+                if in_flight:
+                    collect(retries.seconds_until_due())
+                else:
+                    time.sleep(retries.seconds_until_due())
+
+    metrics.remove_gauge("fetch_in_flight")
+    metrics.remove_gauge("fetch_retry_queue")
+    report_finished(settings)
+
+
+def report_finished(settings):
+    if settings.proxy_pool:
+        print(f"Proxy statistics: {settings.proxy_pool.stats()}")
+    print("Processing complete.")
@@ -1,26 +1,26 @@
-import requests
 import logging
-from bs4 import BeautifulSoup
-import re
-import json
-def get_provider(url):
-    payload = {}
-    headers = {}
+from functions.fetch_data_bulk import Fetcher, FetchSettings
+# Re-exported: extract_data used to live in this module
+from functions.page_state import extract_data
 
-    response = requests.get(url, headers=headers, data=payload) # or requests.post() based on your api
+_default_fetcher = None
+
+
+def get_provider(url, fetcher=None):
+    """Fetches one provider page and extracts its doctor data.
+
+    Pass a Fetcher to reuse its session, rate limiter and proxy settings;
+    otherwise a module-wide one is created on first use.
+    """
+    global _default_fetcher
+    if fetcher is None:
+        if _default_fetcher is None:
+            _default_fetcher = Fetcher(FetchSettings(headers={}))
+        fetcher = _default_fetcher
+
+    response = fetcher.get(url, headers=fetcher.headers)
     logging.info(f"status: {response.status_code} for url {url}")
     response.raise_for_status()
-    response_data = response.text
-    extracted_data = extract_data(response_data)
+    # The raw bytes go straight to the extractor, no decoding of the whole page
+    extracted_data = extract_data(response.content)
     return extracted_data
-
-def extract_data(html_content):
-    soup = BeautifulSoup(html_content, 'html.parser')
-    script_tag = soup.find('script', string=re.compile(r'window\[\'__PAGE_CONTEXT_QUERY_STATE__\'\]'))
-    json_data = re.finditer(r'window\[\'__PAGE_CONTEXT_QUERY_STATE__\'\] = {(.*?)};', script_tag.text)
-    for match in json_data:
-        data = match.group(1)
-        data = "{" + data + "}"
-        data = json.loads(data.replace('undefined','null'))
-        data = data["src\u002Fcontainers\u002Fpages\u002Fhealth\u002Fdoctors\u002Fprofile\u002Fprofile.js"]["data"]["context"]["doctor"]
-        return data
\ No newline at end of file
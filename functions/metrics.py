@@ -0,0 +1,202 @@
+import json
+import time
+import logging
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds in seconds; the last bucket catches everything slower
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _key(name, labels):
+    if not labels:
+        return name
+    return name + "{" + ",".join(f"{k}={v}" for k, v in sorted(labels.items())) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile (inf past the last bucket)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "avg": round(self.sum / self.count, 6) if self.count else None,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+        }
+
+
+class Metrics:
+    """Thread-safe counters, gauges and latency histograms keyed by name and labels.
+
+    Gauges can also be callables (e.g. a queue's length), sampled whenever a
+    snapshot is taken. Each process has its own registry: formatter process
+    pool workers report their format_json timings only in their own process.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.started = clock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        """Sets a gauge to a number, or to a callable evaluated at snapshot time."""
+        with self._lock:
+            self._gauges[_key(name, labels)] = value
+
+    def remove_gauge(self, name, **labels):
+        with self._lock:
+            self._gauges.pop(_key(name, labels), None)
+
+    def observe(self, name, value, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            histograms = {key: histogram.summary() for key, histogram in self._histograms.items()}
+        uptime = self.clock() - self.started
+        for key, value in gauges.items():
+            if callable(value):
+                try:
+                    gauges[key] = value()
+                except Exception as e:
+                    gauges[key] = f"error: {e}"
+        return {
+            "uptime": round(uptime, 3),
+            "counters": counters,
+            "rates": {key: round(value / uptime, 3) for key, value in counters.items()} if uptime > 0 else {},
+            "gauges": gauges,
+            "histograms": histograms,
+        }
+
+
+# The registry the crawl and formatter report to
+metrics = Metrics()
+
+
+class MetricsReporter:
+    """Logs a JSON snapshot every `interval` seconds, with per-interval counter rates."""
+
+    def __init__(self, registry=metrics, interval=30, logger=None):
+        self.registry = registry
+        self.interval = interval
+        self.logger = logger or logging.getLogger("metrics")
+        self._stop = threading.Event()
+        self._previous = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        self._thread.start()
+
+    def report(self):
+        snapshot = self.registry.snapshot()
+        if self._previous is not None:
+            elapsed = snapshot["uptime"] - self._previous["uptime"]
+            if elapsed > 0:
+                snapshot["interval_rates"] = {
+                    key: round((value - self._previous["counters"].get(key, 0)) / elapsed, 3)
+                    for key, value in snapshot["counters"].items()
+                }
+        self._previous = snapshot
+        self.logger.info(json.dumps(snapshot, default=str))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.report()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.report()
+
+
+def setup_metrics_log(path):
+    """Sends the "metrics" logger to a JSON Lines file (one snapshot per line)."""
+    logger = logging.getLogger("metrics")
+    logger.handlers.clear()
+    handler = logging.FileHandler(path)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    return logger
+
+
+def serve_metrics(registry=metrics, host="127.0.0.1", port=9100):
+    """Serves GET /metrics as a JSON snapshot on a background thread; returns the server."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.rstrip("/") not in ("", "/metrics"):
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = json.dumps(registry.snapshot(), default=str).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -1,22 +1,360 @@
-import json
 import os
+import time
+import hashlib
 import logging
 from tqdm import tqdm
+import multiprocessing
+import threading
 from multiprocessing.pool import ThreadPool
 import shutil
 from collections import defaultdict
+from itertools import islice
 from datetime import datetime
+from functools import partial
+from functions import serializer
+from functions.storage import ShardReader
+from functions.sqlite_batch import BatchedWriter, connect
+from functions.metrics import metrics
+from functions.projection import project
+
+BASE_IMAGE_URL = "https://images.opencare.com/"
+FORMAT_VERSION = "1.0.1"
+# Bump whenever format_json output changes, so every record is re-formatted once
+FORMATTER_REVISION = 1
+MANIFEST_FILE = "format_manifest.db"
+# Tasks handed to a pool at a time; pools read their whole input up front
+TASK_BATCH = 10000
+
+# Everything below is defined once at import time; format_json only calls it.
+
+
+def _value_or_empty(data, key):
+    value = data.get(key)
+    return value if value is not None else ""
+
+
+def _extract_personal_statements(data):
+    about_data = data.get("about")
+    if about_data is None:
+        return ""
+    return {"key_1 : about": about_data}
+
+
+def _extract_names(items):
+    return [s.get("name", "") for s in items if s.get("name")]
+
+
+def _extract_languages(data):
+    languages = data.get("languages", [])
+    return [] if languages is None else _extract_names(languages)
+
+
+def _extract_rating_info(data):
+    review_data = data.get("aggregateReviewData")
+    if review_data is None:
+        return 0, 0
+    return review_data.get("averageRating", 0), review_data.get("dataPoints", 0)
+
+
+def _extract_education_info(data):
+    metadata = data.get("metadata") or {}
+    formatted_education = []
+
+    for edu in metadata.get("education") or []:
+        degree = edu.get("degree", "").strip()
+        institution = edu.get("institution", "").strip()
+        year = edu.get("year", "")
+
+        # Skip if all fields are empty
+        if not (degree or institution or year):
+            continue
+
+        formatted_education.append(f"{degree}, {institution}, {year}")
+
+    return formatted_education
+
+
+def _extract_insurances(data):
+    grouped = defaultdict(list)
+
+    for plan in data.get("insurancePlans") or []:
+        if not plan:
+            continue
+
+        provider = plan.get("provider") or {}
+        provider_name = (provider.get("name") or "").strip()
+        plan_name = (plan.get("name") or "").strip()
+
+        if provider_name and plan_name:
+            grouped[provider_name].append({"name": plan_name})
+
+    return [{"name": provider, "plans": plans} for provider, plans in grouped.items()]
+
+
+def _extract_reviews(data, source_number=1):
+    formatted_reviews = []
+
+    for review in data.get("reviews", []):
+        rating = review.get("overallRating")
+        text = review.get("description", "")
+        date_raw = review.get("createdAt", "")
+        reviewer_first = review.get("patientFirstName", "")
+        reviewer_last = review.get("patientLastInitial", "")
+
+        # Skip if rating or text or reviewer is missing
+        if rating is None or not text.strip() or not reviewer_first.strip():
+            continue
+
+        # Format date
+        date = ""
+        if date_raw:
+            try:
+                date = datetime.fromisoformat(date_raw.replace("Z", "+00:00")).date().isoformat()
+            except ValueError:
+                pass
+
+        formatted_reviews.append({
+            "source": int(source_number),
+            "rating": rating,
+            "text": text.strip(),
+            "date": date,
+            "reviewer": f"{reviewer_first} {reviewer_last}".strip(),
+        })
+
+    return formatted_reviews
+
+
+def _format_phone_number(phone: str) -> str:
+    if phone and phone.startswith("+1") and len(phone) == 12:
+        return f"({phone[2:5]}) {phone[5:8]}-{phone[8:]}"
+    return phone  # return as-is if null, empty, or invalid format
+
+
+def _photo_urls(photos, size):
+    urls = []
+    for photo in photos:
+        name = photo.get("name")
+        ext = photo.get("extension")
+        if name and ext:
+            urls.append(f"{BASE_IMAGE_URL}{name}-{size}.{ext}")
+    return urls
+
+
+def _extract_doctor_images(data):
+    images = []
+    primary = data.get("primaryPhoto")
+    if primary:
+        images.extend(_photo_urls([primary], "200x200"))
+    images.extend(_photo_urls(data.get("photos", []), "700x700"))
+    return images
+
+
+def _extract_booking_info(instant_book):
+    booking_info = []
+    for room in instant_book.get("rooms", []):
+        provider_id = room.get("providerId")
+        for mapping in room.get("mappings", []):
+            booking_info.append({
+                "provider_id": provider_id,
+                "room_id": mapping.get("roomId"),
+                "appointment_duration": mapping.get("appointmentDuration"),
+                "sync_strategy": room.get("syncStrategy"),
+                "double_booking_enabled": room.get("doubleBookingEnabled"),
+                "mappings_order_reversible": room.get("mappingsOrderReversible")
+            })
+    return booking_info
+
+
+def _format_location(clinic):
+    address = clinic.get("address", {}) or {}
+    return {
+        "phone_numbers": {
+            "location_phone": {
+                "number": _format_phone_number(clinic.get("phone", "")),
+                "visible_in_frontend": True,
+            }
+        },
+        "fax": clinic.get("fax", ""),
+        "name": clinic.get("name", "").strip(),
+        "city": address.get("locality", ""),
+        "state": address.get("administrative_area_level_1_short", ""),
+        "zip_code": address.get("postal_code", ""),
+        "latitude": clinic.get("latitude", ""),
+        "longitude": clinic.get("longitude", ""),
+        "is_virtual": False,
+        "is_in_person": True,
+        "county": address.get("administrative_area_level_2", ""),
+        "website": clinic.get("website", ""),
+        "medicare_accepted": True,
+        "medicaid_accepted": True,
+        "accepts_new_patients": True,
+        "state_full_name": address.get("administrative_area_level_1", ""),
+        "state_slug": "",  # Optional slugify(state)
+        "city_slug": "",   # Optional slugify(city)
+        "directions_url": "",  # Optional Google Maps link
+        "nation": address.get("country", ""),
+        "street": f"{address.get('street_number', '')} {address.get('route', '')}".strip(),
+        "booking_info": _extract_booking_info(clinic.get("instantBookConfiguration", {})),
+        "external_urls": {
+            "form_urls": [""],
+            "chat_urls": [""],
+            "telemedicine_urls": [""],
+        },
+    }
+
+
+def _extract_provider_fields(data):
+    """Walks data["providers"] once and builds every provider/clinic derived field.
+
+    Awards and the claimed flag come from the last provider with a clinic, as
+    they always have; a record without any clinic cannot be formatted.
+    """
+    doctor_images = _extract_doctor_images(data)
+    fields = {"locations": [], "images": [], "payments": [], "services": []}
+    has_clinic = False
+
+    for provider in data.get("providers", []):
+        for item in provider.get("offeredServices", []):
+            service = item.get("service")
+            if service and isinstance(service, dict) and service.get("name"):
+                # Remove forward slashes and strip whitespace
+                fields["services"].append(service["name"].replace("/", "").strip())
+
+        clinic = provider.get("clinic", {})
+        if not clinic:
+            continue
+        has_clinic = True
+
+        fields["locations"].append(_format_location(clinic))
+        fields["images"].append(
+            {"images": doctor_images + _photo_urls(clinic.get("photos", []), "700x700")}
+        )
+        payment_methods = clinic.get("paymentMethods") or []
+        fields["payments"].append(
+            {"paymentMethods": payment_methods if isinstance(payment_methods, list) else []}
+        )
+        fields["awards"] = clinic.get("awardData", {}) or {}
+        fields["is_claimed"] = bool(clinic.get("claimedAt"))
+
+    if not has_clinic:
+        raise ValueError("Provider record has no clinic to format")
+    return fields
+
+
+def _clean_data(value):
+    """Recursively remove keys with empty, null, or default-empty values.
+
+    Each node is pruned exactly once, bottom-up. Dict entries are dropped when
+    they are None, "", 0/False or a container that prunes to empty; list items
+    when they are None, "" or a container that prunes to empty.
+    """
+    if isinstance(value, dict):
+        cleaned = {}
+        for k, v in value.items():
+            if isinstance(v, (dict, list)):
+                v = _clean_data(v)
+                if v:
+                    cleaned[k] = v
+            elif not (v is None or v == "" or v == 0):
+                cleaned[k] = v
+        return cleaned
+    elif isinstance(value, list):
+        cleaned_list = []
+        for v in value:
+            if isinstance(v, (dict, list)):
+                v = _clean_data(v)
+                if v:
+                    cleaned_list.append(v)
+            elif not (v is None or v == ""):
+                cleaned_list.append(v)
+        return cleaned_list
+    return value
+
+
+class FormatManifest:
+    """Remembers which raw record digest each formatted output was built from.
+
+    The formatter skips a record when its digest (raw content plus formatter
+    version, see JSONFormatter.record_digest) matches the stored one, so a
+    rerun only re-formats records whose input or formatter changed. Writes
+    are batched like the crawl checkpoint's.
+    """
+
+    def __init__(self, path, batch_size=500, flush_interval=5.0):
+        self.path = path
+        self.conn = connect(path)
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS manifest (
+                name TEXT PRIMARY KEY,
+                digest TEXT NOT NULL,
+                updated_at REAL
+            )"""
+        )
+        self.conn.commit()
+        self._writer = BatchedWriter(
+            self.conn, "INSERT OR REPLACE INTO manifest (name, digest, updated_at) VALUES (?, ?, ?)",
+            batch_size, flush_interval,
+        )
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get(self, name):
+        """Returns the digest the output `name` was last formatted from, or None."""
+        with self._lock:
+            pending = self._writer.get(name)
+            if pending:
+                return pending[1]
+            row = self.conn.execute("SELECT digest FROM manifest WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def record(self, name, digest):
+        with self._lock:
+            self._writer.add((name, digest, time.time()), key=name)
+
+    def flush(self):
+        with self._lock:
+            self._writer.flush()
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
 
 class JSONFormatter:
     def __init__(
-        self, output_dir, raw_data_dir="raw_data", formatted_dir="formatted", threads=10
+        self, output_dir, raw_data_dir="raw_data", formatted_dir="formatted", threads=10,
+        mode="threads", processes=None, chunksize=64, compact=False, storage="files",
+        overwrite=False, projection=None,
     ):
+        # Constructor arguments, used to build identical formatters in pool workers
+        self.config = dict(
+            output_dir=output_dir, raw_data_dir=raw_data_dir, formatted_dir=formatted_dir,
+            compact=compact, storage=storage, overwrite=overwrite, projection=projection,
+        )
         self.output_dir = output_dir
         self.raw_data_dir = os.path.join(output_dir, raw_data_dir)
         self.formatted_dir = os.path.join(output_dir, formatted_dir)
         self.errors_dir = os.path.join(output_dir, "Error_Formatting")
         self.log_file = os.path.join(output_dir, "formatting.log")
         self.threads = threads
+        # mode="processes" spreads the CPU bound formatting across all cores
+        self.mode = mode
+        self.processes = processes or os.cpu_count()
+        self.chunksize = chunksize
+        self.compact = compact
+        # storage="shards" reads raw records from the gzip JSONL shards of functions/storage.py
+        self.storage = storage
+        self.reader = ShardReader(self.raw_data_dir) if storage == "shards" else None
+        # overwrite=True re-formats records even when their output already exists
+        self.overwrite = overwrite
+        # projection: a functions/projection.py spec; records are cut down to it before
+        # they are hashed and formatted, so full and projected archives format alike
+        self.projection = projection
         os.makedirs(self.formatted_dir, exist_ok=True)
         os.makedirs(self.errors_dir, exist_ok=True)
 
@@ -31,377 +369,43 @@ class JSONFormatter:
         )
 
     def format_json(self, input):
-        def extract_name_info(data):
-            # Check if 'aggregateReviewData' is None or missing and handle it gracefully
-            name_data = data.get("name")  # Will return None if not found
-            if name_data is not None:
-                return  name_data
-            else:
-                return ""
-        def extract_personal_statements(data):
-            # Check if 'about' is None or missing and handle it gracefully
-            about_data = data.get("about")  # Will return None if not found
-            if about_data is None:
-                return  ""
-            else:           
-                return {
-                    "key_1 : about": about_data
-                }
-        def extract_specialties_info(data):
-            specialties = data.get("specialties") or []
-            return [{"name": s.get("name", "")} for s in specialties if s.get("name")]      
-        def extract_rating_info(data):
-            # Check if 'aggregateReviewData' is None or missing and handle it gracefully
-            review_data = data.get("aggregateReviewData")  # Will return None if not found
-            if review_data is None:
-                return {
-                    "rating": 0,
-                    "rating_count": 0
-                }
-
-            # If the data is present, proceed with extracting values safely
-            rating = review_data.get("averageRating", 0)  # Default to 0 if missing
-            rating_count = review_data.get("dataPoints", 0)  # Default to 0 if missing
-
-            return {
-                "rating": rating,
-                "rating_count": rating_count
-            }
-        def extract_education_info(data):
-            metadata = data.get("metadata") or {}
-            education_list = metadata.get("education") or []
-
-            formatted_education = []
-
-            for edu in education_list:
-                degree = edu.get("degree", "").strip()
-                institution = edu.get("institution", "").strip()
-                year = edu.get("year", "")
-
-                # Skip if all fields are empty
-                if not (degree or institution or year):
-                    continue
-
-                formatted_education.append(f"{degree}, {institution}, {year}")
-
-            return formatted_education
-        def extract_awards_info(data):
-            providers = data.get("providers", [])
-
-            for provider in providers:
-                clinic = provider.get("clinic", {})
-                if not clinic:
-                    continue
-                award_data = clinic.get("awardData", {}) or {}    
-
- 
-            return award_data
-        def extract_payment_methods(data):
-            providers = data.get("providers", [])
-            clinic_payment_methods = []
-
-            for provider in providers:
-                clinic = provider.get("clinic", {})
-                if not clinic:
-                    continue
-
-                payment_methods = clinic.get("paymentMethods") or []
-
-                clinic_payment_methods.append({
-                    "paymentMethods": payment_methods if isinstance(payment_methods, list) else []
-                })
-
-            return clinic_payment_methods
-        def extract_canonicalPath_info(data):
-                # Check if 'aggregateReviewData' is None or missing and handle it gracefully
-            canonicalPath_data = data.get("canonicalPath")  # Will return None if not found
-            if canonicalPath_data is not None:
-                return  canonicalPath_data
-            else:
-                return ""
-        def extract_gender_info(data):
-            # Check if 'aggregateReviewData' is None or missing and handle it gracefully
-            gender_data = data.get("gender")  # Will return None if not found
-            if gender_data is not None:
-                return  gender_data
-            else:
-                return ""
-        def extract_npi_info(data):
-            # Check if 'aggregateReviewData' is None or missing and handle it gracefully
-            npi_data = data.get("npi")  # Will return None if not found
-            if npi_data is not None:
-                return  npi_data
-            else:
-                return ""
-        def extract_fax_info(data):
-            # Check if 'aggregateReviewData' is None or missing and handle it gracefully
-            fax_data = data.get("fax")  # Will return None if not found
-            if fax_data is not None:
-                return  fax_data
-            else:
-                return ""
-        def extract_languages_info(data):
-            languages = data.get("languages", [])
-            if languages is None:
-                return  []
-            else:
-                return [{"name": s.get("name", "")} for s in languages if s.get("name")]
-        def extract_insurances(data):
-            insurance_plans = data.get("insurancePlans") or []
-            grouped = defaultdict(list)
-
-            for plan in insurance_plans:
-                if not plan:
-                    continue
-
-                provider = plan.get("provider") or {}
-                provider_name = provider.get("name") or ""
-                plan_name = plan.get("name") or ""
-
-                provider_name = provider_name.strip()
-                plan_name = plan_name.strip()
-
-                if provider_name and plan_name:
-                    grouped[provider_name].append({"name": plan_name})
-
-            return [{"name": provider, "plans": plans} for provider, plans in grouped.items()]
-        def extract_reviews(data, source_number=1):
-            reviews_data = data.get("reviews", [])
-            formatted_reviews = []
-
-            for review in reviews_data:
-                rating = review.get("overallRating")
-                text = review.get("description", "")
-                date_raw = review.get("createdAt", "")
-                reviewer_first = review.get("patientFirstName", "")
-                reviewer_last = review.get("patientLastInitial", "")
-
-                # Skip if rating or text or reviewer is missing
-                if rating is None or not text.strip() or not reviewer_first.strip():
-                    continue
-
-                # Format date
-                date = ""
-                if date_raw:
-                    try:
-                        date = datetime.fromisoformat(date_raw.replace("Z", "+00:00")).date().isoformat()
-                    except ValueError:
-                        pass
-
-                reviewer = f"{reviewer_first} {reviewer_last}".strip()
-
-                formatted_reviews.append({
-                    "source": int(source_number),
-                    "rating": rating,
-                    "text": text.strip(),
-                    "date": date,
-                    "reviewer": reviewer,
-                })
-
-            return formatted_reviews
-        def extract_providers_info(data):
-            providers = data.get("providers", [])
-            locations = []
-
-            for provider in providers:
-                clinic = provider.get("clinic", {})
-                if not clinic:
-                    continue
-                def format_phone_number(phone: str) -> str:
-                    if phone and phone.startswith("+1") and len(phone) == 12:
-                        area_code = phone[2:5]
-                        first_part = phone[5:8]
-                        second_part = phone[8:]
-                        return f"({area_code}) {first_part}-{second_part}"
-                    return phone  # return as-is if null, empty, or invalid format
-       
-                address = clinic.get("address", {}) or {}
-                fax = clinic.get("fax", "")
-                name = clinic.get("name", "").strip()
-                phone = clinic.get("phone", "")
-                formatted_phone = format_phone_number(phone)
-                website = clinic.get("website", "")
-                latitude = clinic.get("latitude", "")
-                longitude = clinic.get("longitude", "")
-                instant_book = clinic.get("instantBookConfiguration", {})
-
-                # Extract booking info from rooms
-                booking_info = []
-                for room in instant_book.get("rooms", []):
-                    provider_id = room.get("providerId")
-                    for mapping in room.get("mappings", []):
-                        booking_info.append({
-                            "provider_id": provider_id,
-                            "room_id": mapping.get("roomId"),
-                            "appointment_duration": mapping.get("appointmentDuration"),
-                            "sync_strategy": room.get("syncStrategy"),
-                            "double_booking_enabled": room.get("doubleBookingEnabled"),
-                            "mappings_order_reversible": room.get("mappingsOrderReversible")
-                        })
-
-                location = {
-                    "phone_numbers": {
-                        "location_phone": {
-                            "number": formatted_phone,
-                            "visible_in_frontend": True,
-                        }
-                      
-                    },
-                    "fax": fax,
-                    "name": name,
-                    "city": address.get("locality", ""),
-                    "state": address.get("administrative_area_level_1_short", ""),
-                    "zip_code": address.get("postal_code", ""),
-                    "latitude": latitude,
-                    "longitude": longitude,
-                    "is_virtual": False,
-                    "is_in_person": True,
-                    "county": address.get("administrative_area_level_2", ""),
-                    "website": website,
-                    "medicare_accepted": True,
-                    "medicaid_accepted": True,
-                    "accepts_new_patients": True,
-                    "state_full_name": address.get("administrative_area_level_1", ""),
-                    "state_slug": "",  # Optional slugify(state)
-                    "city_slug": "",   # Optional slugify(city)
-                    "directions_url": "",  # Optional Google Maps link
-                    "nation": address.get("country", ""),
-                    "street": f"{address.get('street_number', '')} {address.get('route', '')}".strip(),
-                    "booking_info": booking_info,
-                    "external_urls": {
-                        "form_urls": [""],
-                        "chat_urls": [""],
-                        "telemedicine_urls": [""],
-                    },
-                }
-
-                locations.append(location)
-
-            return locations
-        def extract_services_info(data):
-            providers = data.get("providers", [])
-            services = []
-
-            for provider in providers:
-                offered_services = provider.get("offeredServices", [])
-                for item in offered_services:
-                    service = item.get("service")
-                    if service and isinstance(service, dict):
-                        name = service.get("name")
-                        if name:
-                            # Remove forward slashes and strip whitespace
-                            cleaned_name = name.replace("/", "").strip()
-                            services.append(cleaned_name)
-
-            return services          
-        def extract_claimed_at_info(data):
-            providers = data.get("providers", [])
-
-            for provider in providers:
-                clinic = provider.get("clinic", {})
-                if not clinic:
-                    continue
-
-                claimed_at = clinic.get("claimedAt")
-
-                is_claimed = bool(claimed_at)  # True if claimed_at is not None or empty
-                 
-
-            return is_claimed
-        def extract_images(data):
-            base_url = "https://images.opencare.com/"
-            providers = data.get("providers", [])
-            clinics_images = []
-
-            for provider in providers:
-                clinic = provider.get("clinic", {})
-                if not clinic:
-                    continue
-
-                images = []
-
-                # Handle 'primaryPhoto'
-                primary = data.get("primaryPhoto")
-                if primary:
-                    name = primary.get("name")
-                    ext = primary.get("extension")
-                    if name and ext:
-                        images.append(f"{base_url}{name}-200x200.{ext}")
-                
-                photos = data.get("photos", [])
-                for photo in photos:
-                    name = photo.get("name")
-                    ext = photo.get("extension")
-                    if name and ext:
-                        images.append(f"{base_url}{name}-700x700.{ext}")
-
-                # Handle 'photos'
-                photos = clinic.get("photos", [])
-                for photo in photos:
-                    name = photo.get("name")
-                    ext = photo.get("extension")
-                    if name and ext:
-                        images.append(f"{base_url}{name}-700x700.{ext}")
-
-                clinics_images.append({
-                    "images": images
-                })
-
-            return clinics_images
-        name_info  = extract_name_info(input)
-        rating_info = extract_rating_info(input)
-        education_data_info = extract_education_info(input)
-        canonicalPath_data_info = extract_canonicalPath_info(input)
-        gender_data_info = extract_gender_info(input)
-        npi_data_info = extract_npi_info(input)
-        personal_statements_data_info = extract_personal_statements(input)
-        fax_data_info = extract_fax_info(input)
-        insurances = extract_insurances(input)
-        reviews = extract_reviews(input)
-        locations = extract_providers_info(input)
-        clamied_at= extract_claimed_at_info(input)
-        images = extract_images(input)
-        awards = extract_awards_info(input)
-        payments = extract_payment_methods(input)
-        services = extract_services_info(input)
-        def clean_data(value):
-            """Recursively remove keys with empty, null, or default-empty values."""
-            if isinstance(value, dict):
-                cleaned = {
-                    k: clean_data(v) for k, v in value.items()
-                    if v not in [None, "", [], {}, ["", ""], {"": ""},0]
-                    and not (isinstance(v, (list, dict)) and clean_data(v) in [[], {}])
-                }
-                return cleaned
-            elif isinstance(value, list):
-                cleaned_list = [clean_data(v) for v in value if v not in [None, "", {}, []]]
-                return [item for item in cleaned_list if item not in [None, "", {}, [], [""]]]
-            return value
         """Formats the input JSON into the desired structure."""
+        started = time.perf_counter()
+        # Every extractor runs here, so "build" only times assembling the document
+        rating, rating_count = _extract_rating_info(input)
+        provider_fields = _extract_provider_fields(input)
+        awards = provider_fields["awards"]
+        specialties = _extract_names(input.get("specialties") or [])
+        personal_statements = _extract_personal_statements(input)
+        languages = _extract_languages(input)
+        education = _extract_education_info(input)
+        insurances = _extract_insurances(input)
+        reviews = _extract_reviews(input)
+        extracted = time.perf_counter()
         formatted = {
-            "version": "1.0.1",
-            "name": name_info,
-            "is_claimed": clamied_at,
+            "version": FORMAT_VERSION,
+            "name": _value_or_empty(input, "name"),
+            "is_claimed": provider_fields["is_claimed"],
             "mpc_type": "mpc_cache",
-            "specialties": [d['name'] for d in extract_specialties_info(input)] or [],
+            "specialties": specialties,
             "years_of_experience": input.get("yearsExperience", "") or 0,
-            "rating":rating_info["rating"] ,
-            "rating_count": rating_info["rating_count"],
-            "url": "https://www.opencare.com" + canonicalPath_data_info ,
-            "images": images,
-            "gender":gender_data_info ,     
-            "npi":npi_data_info ,
-            "personal_statements": personal_statements_data_info,
-            "languages": [d['name'] for d in extract_languages_info(input)] or [],  # Flatten the languages list,
-            "locations":  locations,            
-            "education": education_data_info,
-            "offerdservices":services,
+            "rating": rating,
+            "rating_count": rating_count,
+            "url": "https://www.opencare.com" + _value_or_empty(input, "canonicalPath"),
+            "images": provider_fields["images"],
+            "gender": _value_or_empty(input, "gender"),
+            "npi": _value_or_empty(input, "npi"),
+            "personal_statements": personal_statements,
+            "languages": languages,
+            "locations": provider_fields["locations"],
+            "education": education,
+            "offerdservices": provider_fields["services"],
             "issues_treated_and_procedures_performed": {
                 "issues_treated": ["", ""],
                 "procedures_performed": ["", ""],
                 "issues_treated_and_procedures_performed": ["", ""],
             },
-            "insurances":insurances,
+            "insurances": insurances,
             "licenses": ["", ""],
             "review_summary": {
                 "key_1 ex: over_all_summary": "",
@@ -409,7 +413,7 @@ class JSONFormatter:
                 "key_3 ex: negative_summary": "",
                 "key_4": "",
             },
-            "reviews":  reviews,
+            "reviews": reviews,
             "age_ranges": ["", ""],
             "awards_and_publications": {
                 "publications": [
@@ -423,10 +427,15 @@ class JSONFormatter:
                 {"name": "", "address": "", "city": "", "state": ""}
             ],
             "professional_memberships": ["", ""],
-            "payment_descriptions": payments,
+            "payment_descriptions": provider_fields["payments"],
         }
+        built = time.perf_counter()
         # Remove keys with empty values
-        formatted_cleaned = clean_data(formatted)
+        formatted_cleaned = _clean_data(formatted)
+        cleaned = time.perf_counter()
+        metrics.observe("format_stage_seconds", extracted - started, stage="extract")
+        metrics.observe("format_stage_seconds", built - extracted, stage="build")
+        metrics.observe("format_stage_seconds", cleaned - built, stage="clean")
 
         # Log missing or invalid fields
         if formatted_cleaned["name"] == "Unknown Name":
@@ -435,19 +444,89 @@ class JSONFormatter:
             logging.warning(f"Missing or invalid 'npi' in input: {input}")
         return formatted_cleaned
 
-    def process_file(self, file, progress_bar):
-        """Formats a single JSON file and saves the result."""
+    @staticmethod
+    def record_digest(raw_data):
+        """Hashes a raw record together with the formatter version.
+
+        The record is re-serialized compactly first, so the same payload
+        hashes the same whether it came from a file, a shard or the fetcher.
+        """
+        digest = hashlib.blake2b(f"{FORMAT_VERSION}/{FORMATTER_REVISION}\n".encode(), digest_size=16)
+        digest.update(serializer.dumps(raw_data))
+        return digest.hexdigest()
+
+    def open_manifest(self):
+        return FormatManifest(os.path.join(self.output_dir, MANIFEST_FILE))
+
+    def output_name(self, task):
+        if self.storage == "shards":
+            return f"provider_{task.provider_id}.json"
+        return task
+
+    def process_file(self, task, progress_bar, manifest):
+        """Formats a single JSON file (or shard entry) and saves the result."""
+        try:
+            name = self.output_name(task)
+            status, digest = self.format_task(task, manifest.get(name))
+            if status == "formatted":
+                manifest.record(name, digest)
+            metrics.inc("records_formatted", status=status)
+            return status
+        finally:
+            progress_bar.update(1)
+
+    def format_task(self, task, known_digest=None):
+        if self.storage == "shards":
+            return self.format_entry(task, known_digest)
+        return self.format_file(task, known_digest)
+
+    def format_file(self, file, known_digest=None):
+        """Formats a single JSON file.
+
+        Returns (status, digest) with status "skipped", "formatted" or "error";
+        the file is skipped when its digest equals `known_digest`.
+        """
         input_path = os.path.join(self.raw_data_dir, file)
-        output_path = os.path.join(self.formatted_dir, file)
+        return self._format(
+            file,
+            lambda: serializer.load(input_path),
+            lambda error_path: shutil.copy(input_path, error_path),
+            known_digest,
+        )
 
-        # Skip files already processed
-        if os.path.exists(output_path):
-            logging.info(f"Skipping {file} as it has already been formatted.")
-            return
+    def format_entry(self, entry, known_digest=None):
+        """Formats one record of the sharded raw store, see functions/storage.py."""
+
+        def save_input(error_path):
+            with open(error_path, "wb") as f:
+                f.write(self.reader.read_bytes(entry))
+
+        return self._format(
+            f"provider_{entry.provider_id}.json", lambda: self.reader.read(entry), save_input, known_digest
+        )
+
+    def format_payload(self, provider_id, raw_data, known_digest=None):
+        """Formats a freshly fetched API payload, unless it is unchanged since the last run."""
+        return self._format(
+            f"provider_{provider_id}.json",
+            lambda: raw_data,
+            lambda error_path: serializer.dump(raw_data, error_path, indent=2),
+            known_digest,
+        )
+
+    def _format(self, file, load, save_input, known_digest=None):
+        output_path = os.path.join(self.formatted_dir, file)
 
         try:
-            with open(input_path, "r", encoding="utf-8") as infile:
-                raw_data = json.load(infile)
+            raw_data = load()
+            if self.projection is not None:
+                raw_data = project(raw_data, self.projection)
+
+            # Skip records whose input and formatter version are unchanged
+            digest = self.record_digest(raw_data)
+            if not self.overwrite and digest == known_digest and os.path.exists(output_path):
+                logging.info(f"Skipping {file} as it is unchanged since it was formatted.")
+                return "skipped", digest
 
             # Validate input structure
             if isinstance(raw_data, list):
@@ -466,23 +545,177 @@ class JSONFormatter:
                 )
 
             # Save the formatted data
-            progress_bar.update(1)
-            with open(output_path, "w", encoding="utf-8") as outfile:
-                json.dump(formatted_data, outfile, indent=2)
+            output = serializer.dumps(formatted_data, indent=None if self.compact else 2)
+            with open(output_path, "wb") as f:
+                f.write(output)
+            metrics.inc("bytes_written", len(output), store="formatted")
 
             logging.info(f"Successfully formatted: {file}")
+            return "formatted", digest
 
         except Exception as e:
             logging.error(f"Error formatting file {file}: {e}")
-            error_path = os.path.join(self.errors_dir, file)
-            shutil.copy(input_path, error_path)
+            save_input(os.path.join(self.errors_dir, file))
             logging.info(f"Copied {file} to Error_Formatting directory")
+            return "error", None
 
-    def process_directory(self):
-        """Processes all JSON files in the raw_data directory and saves formatted results."""
+    def _tasks(self):
+        """Returns (tasks, count) for every raw record.
+
+        Shard entries come lazily in storage order, so a full pass reads
+        each shard front to back; ID lookups are only for process_ids.
+        """
+        if self.storage == "shards":
+            return self.reader.iter_entries(), len(self.reader)
         files = os.listdir(self.raw_data_dir)
-        with tqdm(total=len(files), desc="Formatting Data") as progress_bar:
+        return files, len(files)
+
+    def _tasks_for_ids(self, ids):
+        tasks = []
+        for provider_id in ids:
+            if self.storage == "shards":
+                task = self.reader.lookup(provider_id)
+            else:
+                task = f"provider_{provider_id}.json"
+                if not os.path.exists(os.path.join(self.raw_data_dir, task)):
+                    task = None
+            if task is None:
+                logging.warning(f"No raw data stored for provider {provider_id}. Skipping.")
+                continue
+            tasks.append(task)
+        return tasks
+
+    def process_ids(self, ids):
+        """Formats only the given provider IDs, looked up directly in the raw store."""
+        tasks = self._tasks_for_ids(ids)
+        self._run(tasks, len(tasks))
+
+    def process_directory(self):
+        """Processes all raw records (files or shards) and saves formatted results."""
+        self._run(*self._tasks())
+
+    def _run(self, tasks, total):
+        with self.open_manifest() as manifest, tqdm(total=total, desc="Formatting Data") as progress_bar:
+            if self.mode == "processes":
+                self._process_with_pool(tasks, progress_bar, manifest)
+                return
             pool = ThreadPool(processes=self.threads)
-            pool.map(lambda file: self.process_file(file, progress_bar), files)
+            for batch in _batches(tasks, TASK_BATCH):
+                pool.map(lambda task: self.process_file(task, progress_bar, manifest), batch)
             pool.close()
             pool.join()
+
+    def _process_with_pool(self, tasks, progress_bar, manifest):
+        """Formats tasks on a process pool; workers only send back (name, status, digest).
+
+        The parent owns the manifest: it looks up each task's last digest
+        while feeding the pool and records the digests of formatted outputs.
+        """
+        statuses = defaultdict(int)
+        with multiprocessing.Pool(
+            processes=self.processes, initializer=_init_worker, initargs=(self.config,)
+        ) as pool:
+            for batch in _batches(tasks, TASK_BATCH):
+                work = [(task, manifest.get(self.output_name(task))) for task in batch]
+                for name, status, digest in pool.imap_unordered(_format_in_worker, work, chunksize=self.chunksize):
+                    if status == "formatted":
+                        manifest.record(name, digest)
+                    # Counted here: the workers' own metrics stay in their processes
+                    metrics.inc("records_formatted", status=status)
+                    statuses[status] += 1
+                    progress_bar.update(1)
+        logging.info(f"Formatting finished: {dict(statuses)}")
+
+
+def _batches(tasks, size):
+    tasks = iter(tasks)
+    while True:
+        batch = list(islice(tasks, size))
+        if not batch:
+            return
+        yield batch
+
+
+# Per-process formatter used by the process pool workers
+_worker_formatter = None
+
+
+def _init_worker(config):
+    global _worker_formatter
+    _worker_formatter = JSONFormatter(**config)
+
+
+def _format_in_worker(work):
+    task, known_digest = work
+    return (_worker_formatter.output_name(task),) + _worker_formatter.format_task(task, known_digest)
+
+
+def _format_payload_in_worker(provider_id, raw_data, known_digest):
+    return _worker_formatter.format_payload(provider_id, raw_data, known_digest)
+
+
+class FormatPipeline:
+    """Formats fetched payloads while the crawl is still running.
+
+    Fetch workers call submit() (it fits fetch_all_data's on_payload hook);
+    payloads go to the formatter's thread or process pool, and at most
+    `max_pending` of them are queued, so a slow formatter applies
+    back-pressure to the fetchers instead of buffering the whole crawl.
+    """
+
+    def __init__(self, formatter, max_pending=256):
+        self.formatter = formatter
+        self.manifest = formatter.open_manifest()
+        self.statuses = defaultdict(int)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self.pending = 0
+        metrics.set_gauge("format_pending", lambda: self.pending)
+        if formatter.mode == "processes":
+            self._pool = multiprocessing.Pool(
+                processes=formatter.processes, initializer=_init_worker, initargs=(formatter.config,)
+            )
+            self._func = _format_payload_in_worker
+        else:
+            self._pool = ThreadPool(processes=formatter.threads)
+            self._func = formatter.format_payload
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def submit(self, provider_id, raw_data):
+        name = f"provider_{provider_id}.json"
+        self._slots.acquire()
+        with self._lock:
+            self.pending += 1
+        self._pool.apply_async(
+            self._func, (provider_id, raw_data, self.manifest.get(name)),
+            callback=partial(self._done, name), error_callback=self._failed,
+        )
+
+    def _done(self, name, result):
+        status, digest = result
+        if status == "formatted":
+            self.manifest.record(name, digest)
+        self._finished(status)
+
+    def _failed(self, error):
+        logging.error(f"Streaming formatter failed: {error}")
+        self._finished("error")
+
+    def _finished(self, status):
+        metrics.inc("records_formatted", status=status)
+        with self._lock:
+            self.statuses[status] += 1
+            self.pending -= 1
+        self._slots.release()
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+        self.manifest.close()
+        metrics.remove_gauge("format_pending")
+        logging.info(f"Streaming formatting finished: {dict(self.statuses)}")
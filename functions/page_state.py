@@ -0,0 +1,67 @@
+import re
+import json
+import logging
+from bs4 import BeautifulSoup
+
+# Provider pages embed their data as `window['__PAGE_CONTEXT_QUERY_STATE__'] = {...};`
+STATE_MARKER = re.compile(rb"""window\[(['"])__PAGE_CONTEXT_QUERY_STATE__\1\]\s*=\s*""")
+_STATE_ASSIGNMENT = re.compile(STATE_MARKER.pattern.decode("ascii"))
+SCRIPT_END = b"</script>"
+PROFILE_KEY = "src/containers/pages/health/doctors/profile/profile.js"
+
+# A JSON string literal, or a bare JavaScript `undefined` outside of one
+_string_or_undefined = re.compile(r'"(?:[^"\\]|\\.)*"|\bundefined\b', re.DOTALL)
+_decoder = json.JSONDecoder()
+
+
+def _replace_undefined(text):
+    """Turns JavaScript `undefined` tokens into JSON null, leaving string contents alone."""
+    if "undefined" not in text:
+        return text
+    return _string_or_undefined.sub(
+        lambda match: "null" if match.group(0) == "undefined" else match.group(0), text
+    )
+
+
+def _decode_object(text):
+    """Decodes the object literal at the start of `text`, ignoring what follows it."""
+    state, _ = _decoder.raw_decode(_replace_undefined(text))
+    return state
+
+
+def extract_page_state(content):
+    """Returns the page state object of a provider page without building a DOM.
+
+    `content` may be the raw response bytes or text. Only the assignment's
+    own <script> is decoded, and raw_decode stops at the end of the object.
+    Raises ValueError when the marker is missing or the object is not JSON.
+    """
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    match = STATE_MARKER.search(content)
+    if not match:
+        raise ValueError("Page state marker not found")
+    end = content.find(SCRIPT_END, match.end())
+    script = content[match.end(): end if end != -1 else len(content)]
+    return _decode_object(script.decode("utf-8", "replace"))
+
+
+def _extract_page_state_with_soup(content):
+    """Slow path: locate the script through a full HTML parse."""
+    soup = BeautifulSoup(content, "html.parser")
+    # Only a script assigning the state matches, not one that merely reads it
+    script_tag = soup.find("script", string=_STATE_ASSIGNMENT)
+    if script_tag is None:
+        raise ValueError("Page state script not found")
+    match = _STATE_ASSIGNMENT.search(script_tag.text)
+    return _decode_object(script_tag.text[match.end():])
+
+
+def extract_data(html_content):
+    """Returns the doctor object embedded in a provider page (bytes or text)."""
+    try:
+        state = extract_page_state(html_content)
+    except ValueError as e:
+        logging.warning(f"Fast page state extraction failed ({e}), parsing the full page.")
+        state = _extract_page_state_with_soup(html_content)
+    return state[PROFILE_KEY]["data"]["context"]["doctor"]
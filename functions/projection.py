@@ -0,0 +1,88 @@
+"""Declarative projections of raw provider records.
+
+A spec is a dict mapping field names to either ALL (keep the value as is)
+or a nested spec. A nested spec applies to a dict value, or to every dict
+item of a list value. Fields missing from the record stay missing and
+fields outside the spec are dropped, so a projected record looks to its
+reader exactly like the full one.
+"""
+
+ALL = True
+
+_PHOTO = {"name": ALL, "extension": ALL}
+
+# Every field JSONFormatter.format_json reads; keep it in step with the
+# _extract_* helpers of functions/mpc_formatter.py
+FORMAT_PROJECTION = {
+    "name": ALL,
+    "npi": ALL,
+    "gender": ALL,
+    "about": ALL,
+    "canonicalPath": ALL,
+    "yearsExperience": ALL,
+    "specialties": {"name": ALL},
+    "languages": {"name": ALL},
+    "aggregateReviewData": {"averageRating": ALL, "dataPoints": ALL},
+    "metadata": {"education": {"degree": ALL, "institution": ALL, "year": ALL}},
+    "insurancePlans": {"name": ALL, "provider": {"name": ALL}},
+    "reviews": {
+        "overallRating": ALL,
+        "description": ALL,
+        "createdAt": ALL,
+        "patientFirstName": ALL,
+        "patientLastInitial": ALL,
+    },
+    "primaryPhoto": _PHOTO,
+    "photos": _PHOTO,
+    "providers": {
+        "offeredServices": {"service": {"name": ALL}},
+        "clinic": {
+            "name": ALL,
+            "phone": ALL,
+            "fax": ALL,
+            "website": ALL,
+            "latitude": ALL,
+            "longitude": ALL,
+            "claimedAt": ALL,
+            "awardData": ALL,
+            "paymentMethods": ALL,
+            "photos": _PHOTO,
+            "address": {
+                "street_number": ALL,
+                "route": ALL,
+                "locality": ALL,
+                "administrative_area_level_1": ALL,
+                "administrative_area_level_1_short": ALL,
+                "administrative_area_level_2": ALL,
+                "postal_code": ALL,
+                "country": ALL,
+            },
+            "instantBookConfiguration": {
+                "rooms": {
+                    "providerId": ALL,
+                    "syncStrategy": ALL,
+                    "doubleBookingEnabled": ALL,
+                    "mappingsOrderReversible": ALL,
+                    "mappings": {"roomId": ALL, "appointmentDuration": ALL},
+                },
+            },
+        },
+    },
+}
+
+
+def project(value, spec):
+    """Returns the part of `value` selected by `spec`; the input is not modified.
+
+    A top-level list (the API wraps the provider in one) is projected item by
+    item, and values the spec expects to be containers but are not (None,
+    strings) are kept as they are, so the reader sees the same shapes.
+    """
+    if spec is ALL:
+        return value
+    if isinstance(value, dict):
+        return {key: project(value[key], sub) for key, sub in spec.items() if key in value}
+    if isinstance(value, list):
+        return [project(item, spec) for item in value]
+    return value
+
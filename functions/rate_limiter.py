@@ -0,0 +1,88 @@
+import time
+import asyncio
+import threading
+from urllib.parse import urlsplit
+
+# Status codes that mean the host wants us to back off
+THROTTLE_STATUSES = {429, 503}
+
+
+class TokenBucket:
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def reserve(self, now):
+        """Takes one token and returns how long the caller must wait before using it."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+
+class RateLimiter:
+    """Per-host token buckets shared by every worker, with adaptive rates.
+
+    Each host starts at `rate` requests/second with up to `burst` requests
+    allowed back to back. Throttling responses (429/503) multiply the host
+    rate by `slow_down`, healthy responses multiply it by `speed_up`, and
+    the rate always stays between `min_rate` and `max_rate`. Requests sent
+    through a proxy (`via`) get their own bucket per proxy and host, so the
+    budget scales with the number of egress points.
+    """
+
+    def __init__(self, rate=1.0, burst=5, min_rate=0.05, max_rate=None,
+                 slow_down=0.5, speed_up=1.05, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate or rate
+        self.slow_down = slow_down
+        self.speed_up = speed_up
+        self.clock = clock
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, host):
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            bucket = self._buckets[host] = TokenBucket(self.rate, self.burst, self.clock())
+        return bucket
+
+    @staticmethod
+    def _key(url, via=None):
+        host = urlsplit(url).netloc
+        return host if via is None else (via, host)
+
+    def reserve(self, url, via=None):
+        host = self._key(url, via)
+        with self._lock:
+            return self._bucket(host).reserve(self.clock())
+
+    def wait(self, url, via=None):
+        delay = self.reserve(url, via)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def wait_async(self, url, via=None):
+        delay = self.reserve(url, via)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def feedback(self, url, status_code, via=None):
+        """Adjusts the host rate from the status code of a finished request."""
+        host = self._key(url, via)
+        with self._lock:
+            bucket = self._bucket(host)
+            if status_code in THROTTLE_STATUSES:
+                bucket.rate = max(self.min_rate, bucket.rate * self.slow_down)
+            elif status_code < 400:
+                bucket.rate = min(self.max_rate, bucket.rate * self.speed_up)
+
+    def current_rate(self, url, via=None):
+        with self._lock:
+            return self._bucket(self._key(url, via)).rate
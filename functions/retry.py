@@ -0,0 +1,158 @@
+import json
+import time
+import heapq
+import random
+import asyncio
+import threading
+from email.utils import parsedate_to_datetime
+import requests
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# Failure classes: permanent failures are never retried, throttling and
+# transient failures are retried with backoff
+PERMANENT = "permanent"
+THROTTLED = "throttled"
+TRANSIENT = "transient"
+
+# 4xx statuses that are worth retrying (timeouts and "too early")
+RETRYABLE_CLIENT_STATUSES = {408, 425}
+
+# Network failures of either fetch engine; orjson's decode error subclasses json's
+NETWORK_ERRORS = (requests.RequestException, asyncio.TimeoutError) + ((aiohttp.ClientError,) if aiohttp else ())
+
+
+class FetchError(Exception):
+    """An HTTP response that is not a success, with its failure class."""
+
+    def __init__(self, url, status, retry_after=None):
+        super().__init__(f"HTTP {status} for {url}")
+        self.url = url
+        self.status = status
+        self.retry_after = retry_after
+        self.kind = classify_status(status)
+
+
+class RetryLater(Exception):
+    """Raised by a worker to hand its URL back for a deferred retry after `delay` seconds."""
+
+    def __init__(self, delay, cause=None):
+        super().__init__(f"retry in {delay:.1f}s: {cause}")
+        self.delay = delay
+        self.cause = cause
+
+
+def classify_status(status):
+    if status == 429:
+        return THROTTLED
+    if status >= 500 or status in RETRYABLE_CLIENT_STATUSES:
+        return TRANSIENT
+    return PERMANENT
+
+
+def classify(error):
+    """Failure class of an exception raised while fetching.
+
+    Timeouts, connection errors and undecodable bodies (often an error page
+    from a proxy) are transient, HTTP statuses are classed by classify_status.
+    Anything else is a local failure after a good response (extraction,
+    store writes, the formatter) that a new download would not fix, so it
+    is permanent.
+    """
+    if isinstance(error, FetchError):
+        return error.kind
+    if isinstance(error, NETWORK_ERRORS + (json.JSONDecodeError,)):
+        return TRANSIENT
+    return PERMANENT
+
+
+def parse_retry_after(value, now=None):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP-date), or None."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at - (time.time() if now is None else now))
+
+
+def check_response(url, status, headers):
+    """Raises FetchError unless `status` is a success."""
+    if status >= 400:
+        raise FetchError(url, status, parse_retry_after(headers.get("Retry-After")))
+
+
+class RetryPolicy:
+    """Decides whether and when a failed URL is tried again.
+
+    Delays grow exponentially from `base_delay` up to `max_delay` with full
+    jitter, so workers that failed together do not retry together. A
+    Retry-After header is honored as a lower bound; one longer than
+    `max_retry_after` gives up on the URL for this run. `timeout` is the
+    (connect, read) timeout in seconds applied to every request.
+    """
+
+    def __init__(self, max_attempts=5, base_delay=1.0, max_delay=120.0, max_retry_after=900.0,
+                 timeout=(10, 30), rng=None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+        self.timeout = timeout
+        self.rng = rng or random.Random()
+
+    def backoff(self, attempt):
+        return self.rng.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def next_delay(self, attempt, error):
+        """Delay before retrying after `attempt` (0-based) failed with `error`, or None to give up."""
+        if classify(error) == PERMANENT or attempt + 1 >= self.max_attempts:
+            return None
+        delay = self.backoff(attempt)
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after is not None:
+            if retry_after > self.max_retry_after:
+                return None
+            delay = max(delay, retry_after)
+        return delay
+
+
+class RetryQueue:
+    """Deferred retries ordered by due time, so no worker sleeps while it waits."""
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._heap = []
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, item, delay):
+        with self._lock:
+            self._counter += 1
+            heapq.heappush(self._heap, (self.clock() + delay, self._counter, item))
+
+    def pop_due(self, limit=None):
+        """Removes and returns the items that are due, at most `limit` of them."""
+        due = []
+        now = self.clock()
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now and (limit is None or len(due) < limit):
+                due.append(heapq.heappop(self._heap)[2])
+        return due
+
+    def seconds_until_due(self):
+        """Time until the next retry is due (0 if one is due now), or None when empty."""
+        with self._lock:
+            if not self._heap:
+                return None
+            return max(0.0, self._heap[0][0] - self.clock())
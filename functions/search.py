@@ -38,14 +38,99 @@ import requests
 import xml.etree.ElementTree as ET
 import argparse
 import json
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functions.metrics import metrics
+from functions.checkpoint import open_checkpoint
+from functions.fetch_data_bulk import extract_provider_id
+
+SITEMAP_NS = "{http://www.sitemaps.org/schemas/sitemap/0.9}"
+
+
+class LastmodIndex:
+    """SQLite map of URL -> (sitemap shard, <lastmod>) as last read from the sitemaps.
+
+    This is not crawl state: whether a URL needs fetching is decided against
+    the checkpoint store. It remembers which URLs a shard holds, so a shard
+    answering 304 Not Modified can still hand on its unfetched providers.
+    """
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, lastmod TEXT, shard TEXT)")
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(urls)")]
+        if "shard" not in columns:
+            # Indexes written before shards were tracked; such shards are simply read in full again
+            self.conn.execute("ALTER TABLE urls ADD COLUMN shard TEXT")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS urls_shard ON urls (shard, url)")
+        self.conn.commit()
+        self._lock = threading.Lock()
+
+    def clear_shard(self, shard):
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM urls WHERE shard = ?", (shard,))
+
+    def store(self, shard, entries):
+        """Records (url, lastmod) pairs as listed by `shard`."""
+        with self._lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO urls (url, lastmod, shard) VALUES (?, ?, ?)",
+                [(url, lastmod, shard) for url, lastmod in entries],
+            )
+
+    def has_shard(self, shard):
+        with self._lock:
+            return self.conn.execute("SELECT 1 FROM urls WHERE shard = ? LIMIT 1", (shard,)).fetchone() is not None
+
+    def iter_shard(self, shard, batch_size=1000):
+        """Yields the stored (url, lastmod) pairs of `shard` in batches."""
+        last = ""
+        while True:
+            with self._lock:
+                batch = self.conn.execute(
+                    "SELECT url, lastmod FROM urls WHERE shard = ? AND url > ? ORDER BY url LIMIT ?",
+                    (shard, last, batch_size),
+                ).fetchall()
+            if not batch:
+                return
+            yield batch
+            last = batch[-1][0]
+
+    def close(self):
+        self.conn.close()
+
+
+def parse_lastmod(lastmod):
+    """Epoch seconds of a sitemap <lastmod> (W3C date or datetime, UTC if no offset), or None."""
+    if not lastmod:
+        return None
+    try:
+        parsed = datetime.fromisoformat(lastmod.strip().replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
 
 class SitemapFetcher:
-    def __init__(self, sitemap_types, output_dir="output", max_retries=3):
+    def __init__(self, sitemap_types, output_dir="output", max_retries=3, max_workers=16, incremental=False,
+                 base_url="https://www.opencare.com"):
         self.sitemap_types = sitemap_types
-        self.base_url = "https://www.opencare.com"
+        # Overridable so the crawl can run against a stand-in server (see benchmarks/)
+        self.base_url = base_url.rstrip("/")
         self.output_dir = output_dir
         self.progress_file = os.path.join(output_dir, "progress.json")
         self.max_retries = max_retries
+        self.max_workers = max_workers
+        self.incremental = incremental
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
         self.progress = self._load_progress()
         self.log_file = os.path.join(output_dir, "sitemap_fetcher.log")
         
@@ -56,8 +141,19 @@ class SitemapFetcher:
             self.output_file = os.path.join(output_dir, "providers_urls.txt")
         elif "clinic" in sitemap_types:
             self.output_file = os.path.join(output_dir, "practices_urls.txt")
-        
+
+        # Incremental runs only write the providers that are not fetched yet or changed
+        # since their last successful fetch, as recorded in the crawl's checkpoint store
+        self.checkpoint = None
+        if incremental:
+            self.output_file = os.path.splitext(self.output_file)[0] + "_delta.txt"
+
         os.makedirs(output_dir, exist_ok=True)
+        if incremental:
+            self.checkpoint = open_checkpoint(output_dir, extract_provider_id)
+        self.lastmod_index = LastmodIndex(os.path.join(output_dir, "sitemap_lastmod.db"))
+        self._progress_lock = threading.Lock()
+        self._write_lock = threading.Lock()
 
         # Configure logging
         logging.basicConfig(
@@ -65,62 +161,224 @@ class SitemapFetcher:
             format="%(asctime)s - %(levelname)s - %(message)s",
             handlers=[logging.StreamHandler(), logging.FileHandler(self.log_file)],
         )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.session.close()
+        self.lastmod_index.close()
+        if self.checkpoint:
+            self.checkpoint.close()
     
     def _load_progress(self):
+        progress = {"fetched": [], "failed": [], "shards": {}}
         if os.path.exists(self.progress_file):
             with open(self.progress_file, "r", encoding="utf-8") as file:
-                return json.load(file)
-        return {"fetched": [], "failed": []}
+                progress.update(json.load(file))
+        return progress
 
     def _save_progress(self):
         with open(self.progress_file, "w", encoding="utf-8") as file:
             json.dump(self.progress, file, indent=4)
     
-    def fetch_sitemap(self, sitemap_type):
-        index = 0
+    def _shard_url(self, sitemap_type, index):
+        return f"{self.base_url}/oc-sitemap-{sitemap_type}-{index}.xml"
+
+    def _shard_exists(self, sitemap_type, index):
+        try:
+            response = self.session.head(self._shard_url(sitemap_type, index), timeout=30)
+        except requests.RequestException as e:
+            logging.warning(f"Probe failed for {sitemap_type} index {index}: {e}")
+            metrics.inc("sitemap_probes", status="error")
+            return False
+        metrics.inc("sitemap_probes", status=response.status_code)
+        return response.status_code == 200
+
+    def _probe(self, executor, sitemap_type, indices):
+        return dict(zip(indices, executor.map(lambda i: self._shard_exists(sitemap_type, i), indices)))
+
+    def find_shard_count(self, sitemap_type, executor):
+        """Finds how many contiguous shards exist, probing indices concurrently.
+
+        The first round probes 0 and the powers of two together to bracket the
+        last shard, then each round probes up to `max_workers` evenly spaced
+        indices inside the bracket, so the count is known after a few round
+        trips instead of one request per shard.
+        """
+        lo, hi = -1, None  # lo: highest index known to exist, hi: lowest known missing
+        exponent = 0
+        while hi is None:
+            indices = [0] + [2 ** i for i in range(exponent, exponent + self.max_workers - 1)]
+            results = self._probe(executor, sitemap_type, indices)
+            lo = max([i for i, ok in results.items() if ok] + [lo])
+            missing = [i for i, ok in results.items() if not ok and i > lo]
+            hi = min(missing) if missing else None
+            exponent += self.max_workers - 1
+
+        while hi - lo > 1:
+            step = max(1, (hi - lo) // (self.max_workers + 1))
+            indices = list(range(lo + step, hi, step))[: self.max_workers]
+            results = self._probe(executor, sitemap_type, indices)
+            lo = max([i for i, ok in results.items() if ok] + [lo])
+            hi = min([i for i, ok in results.items() if not ok and i > lo] + [hi])
+
+        return hi
+
+    def _conditional_headers(self, sitemap_url):
+        # A 304 is only useful if the shard's URLs are known from an earlier read
+        if not self.lastmod_index.has_shard(sitemap_url):
+            return {}
+        validators = self.progress["shards"].get(sitemap_url, {})
+        headers = {}
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+        return headers
+
+    def _record_shard(self, sitemap_url, response=None):
+        """Notes a shard's outcome once its URLs are in the output file.
+
+        The validators only reach progress.json after the whole file is
+        written (see fetch_and_save_sitemaps), so a crashed run reads its
+        shards in full again.
+        """
+        metrics.inc("sitemap_shards", outcome="fetched" if response is not None else "failed")
+        with self._progress_lock:
+            if response is None:
+                self.progress["failed"].append(sitemap_url)
+                return
+            self.progress["fetched"].append(sitemap_url)
+            self.progress["shards"][sitemap_url] = {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+            }
+
+    def _iter_entries(self, stream):
+        """Yields (loc, lastmod) pairs while parsing, freeing each <url> once it is consumed."""
+        root = None
+        for event, elem in ET.iterparse(stream, events=("start", "end")):
+            if root is None:
+                root = elem
+                if root.tag == "Error":
+                    raise PermissionError("AccessDenied")
+            elif event == "end" and elem.tag == f"{SITEMAP_NS}url":
+                yield elem.findtext(f"{SITEMAP_NS}loc"), elem.findtext(f"{SITEMAP_NS}lastmod")
+                root.clear()
+
+    def _needs_fetch(self, entries):
+        """URLs of (url, lastmod) pairs whose provider has no successful fetch since its lastmod.
+
+        URLs without a provider ID are left out; the fetchers cannot use them.
+        """
+        ids = [extract_provider_id(url) for url, _ in entries]
+        fetched = self.checkpoint.success_times(provider_id for provider_id in ids if provider_id)
         urls = []
-        
-        while True:
-            sitemap_url = f"{self.base_url}/oc-sitemap-{sitemap_type}-{index}.xml"
-            
-            response = requests.get(sitemap_url)
-            if response.status_code != 200:
-                logging.info(f"No more sitemaps found for {sitemap_type} at index {index}. Stopping.")
-                break
+        for (url, lastmod), provider_id in zip(entries, ids):
+            if provider_id is None:
+                continue
+            fetched_at = fetched.get(int(provider_id))
+            modified = parse_lastmod(lastmod)
+            if fetched_at is None or (modified is not None and modified > fetched_at):
+                urls.append(url)
+        return urls
 
-            if "AccessDenied" in response.text:
-                logging.warning(f"Access Denied encountered at index {index}. Stopping.")
-                break
+    def _write_batch(self, entries, out):
+        urls = self._needs_fetch(entries) if self.incremental else [url for url, _ in entries]
+        with self._write_lock:
+            for url in urls:
+                out.write(url + "\n")
+        metrics.inc("sitemap_urls", len(urls))
+        return len(urls)
+
+    def _fetch_shard(self, sitemap_type, index, out, batch_size=1000):
+        """Streams one shard into `out` and returns how many URLs were written."""
+        sitemap_url = self._shard_url(sitemap_type, index)
+        headers = self._conditional_headers(sitemap_url) if self.incremental else {}
+        with self.session.get(sitemap_url, headers=headers, timeout=60, stream=True) as response:
+            if response.status_code == 304:
+                # Unchanged, but providers listed in it may still be unfetched or failed
+                logging.info(f"Sitemap {sitemap_url} not modified since last crawl. Using its stored URLs.")
+                metrics.inc("sitemap_shards", outcome="not_modified")
+                return sum(
+                    self._write_batch(batch, out) for batch in self.lastmod_index.iter_shard(sitemap_url, batch_size)
+                )
+
+            if response.status_code != 200:
+                logging.warning(f"Sitemap {sitemap_url} returned {response.status_code}. Skipping.")
+                self._record_shard(sitemap_url)
+                return 0
 
             logging.info(f"Fetching URLs from: {sitemap_url}")
-            
+
+            # Parse straight off the socket; only one <url> element and one
+            # batch of pending lines are held in memory at a time.
+            response.raw.decode_content = True
+            written = 0
+            batch = []
+            self.lastmod_index.clear_shard(sitemap_url)
             try:
-                root = ET.fromstring(response.content)
-            except ET.ParseError:
-                logging.error(f"Failed to parse XML at index {index}. Skipping.")
-                logging.error(f"Response Content:\n{response.text}")
-                break
-
-            for loc in root.findall(".//{http://www.sitemaps.org/schemas/sitemap/0.9}loc"):
-                urls.append(loc.text)
-            
-            index += 1
-        
-        return urls
-    
+                for entry in self._iter_entries(response.raw):
+                    batch.append(entry)
+                    if len(batch) >= batch_size:
+                        self.lastmod_index.store(sitemap_url, batch)
+                        written += self._write_batch(batch, out)
+                        batch = []
+                self.lastmod_index.store(sitemap_url, batch)
+                written += self._write_batch(batch, out)
+            except PermissionError:
+                logging.warning(f"Access Denied encountered at index {index}. Skipping.")
+                self._record_shard(sitemap_url)
+                return written
+            except ET.ParseError as e:
+                logging.error(f"Failed to parse XML at index {index}: {e}. Skipping.")
+                self._record_shard(sitemap_url)
+                return written
+
+        self._record_shard(sitemap_url, response)
+        return written
+
+    def _timed_fetch_shard(self, sitemap_type, index, out):
+        with metrics.timer("sitemap_shard_seconds", type=sitemap_type):
+            return self._fetch_shard(sitemap_type, index, out)
+
+    def fetch_sitemap(self, sitemap_type, out):
+        """Fetches every shard of one sitemap type in parallel, streaming URLs to `out` as they are parsed."""
+        total = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            shard_count = self.find_shard_count(sitemap_type, executor)
+            logging.info(f"Found {shard_count} {sitemap_type} sitemaps.")
+
+            futures = {
+                executor.submit(self._timed_fetch_shard, sitemap_type, index, out): index
+                for index in range(shard_count)
+            }
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    total += future.result()
+                except requests.RequestException as e:
+                    logging.error(f"Failed to fetch {sitemap_type} sitemap at index {index}: {e}")
+                    self._record_shard(self._shard_url(sitemap_type, index))
+
+        return total
+
     def fetch_and_save_sitemaps(self):
-        all_urls = []
-        
-        for sitemap_type in self.sitemap_types:
-            logging.info(f"Fetching {sitemap_type} sitemaps...")
-            
-            all_urls.extend(self.fetch_sitemap(sitemap_type))
-        
+        total = 0
+        # Per-run lists; shard validators carry over between runs
+        self.progress["fetched"], self.progress["failed"] = [], []
+
         with open(self.output_file, "w", encoding="utf-8") as f:
-            for url in all_urls:
-                f.write(url + "\n")
-        
-        logging.info(f"Total {len(all_urls)} URLs saved to {self.output_file}")
+            for sitemap_type in self.sitemap_types:
+                logging.info(f"Fetching {sitemap_type} sitemaps...")
+                total += self.fetch_sitemap(sitemap_type, f)
+
+        self._save_progress()
+        logging.info(f"Total {total} URLs saved to {self.output_file}")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
@@ -132,11 +390,12 @@ if __name__ == "__main__":
     )
     # parser.add_argument("--type", choices=["doctor", "clinic", "both"], default="both", help="Choose sitemap type: 'doctors' for providers, 'clinics' for practices, or 'both' for all.")
     parser.add_argument("--type", choices=["doctor"], default="both", help="Choose sitemap type: 'doctors' for providers, 'clinics' for practices, or 'both' for all.")
+    parser.add_argument("--incremental", action="store_true", help="Only output URLs that are new or changed since the last crawl.")
 
     args = parser.parse_args()
 
     # sitemap_types = ["doctor", "clinic"] if args.type == "both" else [args.type]
     sitemap_types = ["doctor"] 
 
-    fetcher = SitemapFetcher(sitemap_types)
-    fetcher.fetch_and_save_sitemaps()
+    with SitemapFetcher(sitemap_types, incremental=args.incremental) as fetcher:
+        fetcher.fetch_and_save_sitemaps()
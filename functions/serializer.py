@@ -0,0 +1,40 @@
+import json
+
+# orjson is optional; everything falls back to the stdlib json module
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(data):
+    """Parses JSON from bytes or str."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj, indent=None):
+    """Serializes obj to UTF-8 bytes; indent=None gives compact output.
+
+    orjson only supports compact output and an indent of 2, so any other
+    indent goes through the slower stdlib encoder.
+    """
+    if orjson is not None and indent in (None, 2):
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+        except TypeError:
+            # e.g. integers beyond 64 bits or non-string keys; let stdlib handle them
+            pass
+    separators = (",", ":") if indent is None else None
+    return json.dumps(obj, ensure_ascii=False, indent=indent, separators=separators).encode("utf-8")
+
+
+def load(path):
+    with open(path, "rb") as f:
+        return loads(f.read())
+
+
+def dump(obj, path, indent=None):
+    with open(path, "wb") as f:
+        f.write(dumps(obj, indent))
@@ -0,0 +1,50 @@
+import time
+import sqlite3
+from itertools import count
+
+
+def connect(path):
+    """A connection to the SQLite file at `path` in WAL mode, shareable across threads."""
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class BatchedWriter:
+    """Buffers rows for one statement and writes them in batched transactions.
+
+    A batch is written once `batch_size` rows are buffered or
+    `flush_interval` seconds have passed since the last write, so a crash
+    can only lose the last uncommitted batch. Not thread-safe on its own:
+    callers hold the lock that also guards their reads of `conn`.
+    """
+
+    def __init__(self, conn, statement, batch_size=500, flush_interval=5.0):
+        self.conn = conn
+        self.statement = statement
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._rows = {}
+        self._serial = count()
+        self._last_flush = time.monotonic()
+
+    def add(self, row, key=None):
+        """Buffers `row`, replacing a buffered row with the same `key` (None is always new)."""
+        self._rows[next(self._serial) if key is None else key] = row
+        if (
+            len(self._rows) >= self.batch_size
+            or time.monotonic() - self._last_flush >= self.flush_interval
+        ):
+            self.flush()
+
+    def get(self, key):
+        """The buffered row for `key`, or None."""
+        return self._rows.get(key)
+
+    def flush(self):
+        if self._rows:
+            with self.conn:
+                self.conn.executemany(self.statement, list(self._rows.values()))
+            self._rows = {}
+        self._last_flush = time.monotonic()
@@ -0,0 +1,270 @@
+import os
+import re
+import glob
+import gzip
+import mmap
+import socket
+import struct
+import time
+import threading
+from array import array
+from collections import namedtuple
+from functions import serializer
+from functions.metrics import metrics
+
+# One index record per write: provider ID, shard number, byte offset, byte length
+INDEX_RECORD = struct.Struct("<QIQI")
+SHARD_SUFFIX = ".jsonl.gz"
+INDEX_SUFFIX = ".idx"
+ID_FIELD = struct.Struct("<Q")
+SORTED_INDEX = "index.sorted"
+SHARD_TABLE = "index.shards"
+
+IndexEntry = namedtuple("IndexEntry", ["provider_id", "shard", "offset", "length"])
+
+
+def default_prefix():
+    """Unique per writing process and sortable by start time, so later runs win on duplicates."""
+    return f"{time.strftime('%Y%m%d%H%M%S')}-{socket.gethostname()}-{os.getpid()}"
+
+
+def shard_name(prefix, number):
+    return f"{prefix}-{number:05d}{SHARD_SUFFIX}"
+
+
+class FileStore:
+    """One provider_<id>.json file per record; the original raw_data layout."""
+
+    def __init__(self, directory, indent=2):
+        self.directory = directory
+        self.indent = indent
+        os.makedirs(directory, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, provider_id, record):
+        json_filepath = os.path.join(self.directory, f"provider_{provider_id}.json")
+        data = serializer.dumps(record, self.indent)
+        with open(json_filepath, "wb") as f:
+            f.write(data)
+        metrics.inc("bytes_written", len(data), store=os.path.basename(self.directory))
+        print(f"Data successfully saved to {json_filepath}")
+
+    def close(self):
+        pass
+
+
+class ShardWriter:
+    """Appends JSON records to rotating gzip JSON Lines shards with an ID index.
+
+    Every record is compressed as its own gzip member, so a reader can seek
+    to an indexed offset and inflate one record, while the concatenated
+    members still form a regular .gz file (`zcat shard | head` works).
+    Each index record is written after its data, so an index entry never
+    points at a record that was not written.
+    """
+
+    def __init__(self, directory, prefix=None, max_shard_bytes=256 * 1024 * 1024, compresslevel=6):
+        self.directory = directory
+        self.prefix = prefix or default_prefix()
+        self.max_shard_bytes = max_shard_bytes
+        self.compresslevel = compresslevel
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+
+        # Continue the last shard of this prefix if there is one
+        pattern = re.compile(re.escape(self.prefix) + r"-(\d+)" + re.escape(SHARD_SUFFIX) + "$")
+        numbers = [
+            int(m.group(1)) for m in map(pattern.match, os.listdir(directory)) if m
+        ]
+        self.shard_number = max(numbers, default=0)
+        self._open_shard()
+        self._index = open(os.path.join(directory, self.prefix + INDEX_SUFFIX), "ab")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _open_shard(self):
+        self._shard = open(os.path.join(self.directory, shard_name(self.prefix, self.shard_number)), "ab")
+        self._shard_size = self._shard.tell()
+
+    def write(self, provider_id, record):
+        data = gzip.compress(serializer.dumps(record) + b"\n", self.compresslevel)
+        with self._lock:
+            if self._shard_size and self._shard_size + len(data) > self.max_shard_bytes:
+                self._shard.close()
+                self.shard_number += 1
+                self._open_shard()
+            offset = self._shard_size
+            self._shard.write(data)
+            self._shard_size += len(data)
+            self._shard.flush()
+            self._index.write(INDEX_RECORD.pack(int(provider_id), self.shard_number, offset, len(data)))
+            self._index.flush()
+        metrics.inc("bytes_written", len(data), store=os.path.basename(self.directory))
+
+    def flush(self):
+        with self._lock:
+            self._shard.flush()
+            self._index.flush()
+
+    def close(self):
+        with self._lock:
+            self._shard.close()
+            self._index.close()
+
+
+class ShardReader:
+    """Reads records back from the shards written by ShardWriter.
+
+    The per-writer .idx files are merged into one ID-sorted, de-duplicated
+    index (index.sorted plus the shard name table index.shards). Lookups
+    binary-search the memory-mapped index and slice the memory-mapped shard,
+    so fetching one provider costs O(log n) and touches no other record.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._sorted_path = os.path.join(directory, SORTED_INDEX)
+        self._shard_table_path = os.path.join(directory, SHARD_TABLE)
+        self._index = None
+        self._shard_names = None
+        self._maps = {}
+        self._lock = threading.Lock()
+
+    def _index_files(self):
+        return sorted(glob.glob(os.path.join(self.directory, "*" + INDEX_SUFFIX)))
+
+    def _iter_raw_entries(self):
+        for index_path in self._index_files():
+            prefix = os.path.basename(index_path)[: -len(INDEX_SUFFIX)]
+            with open(index_path, "rb") as f:
+                data = f.read()
+            # Ignore a trailing partial record left by a crash mid-write
+            usable = len(data) - len(data) % INDEX_RECORD.size
+            for provider_id, number, offset, length in INDEX_RECORD.iter_unpack(data[:usable]):
+                yield IndexEntry(provider_id, shard_name(prefix, number), offset, length)
+
+    def _index_is_stale(self):
+        if not os.path.exists(self._sorted_path) or not os.path.exists(self._shard_table_path):
+            return True
+        built = os.path.getmtime(self._sorted_path)
+        return any(os.path.getmtime(path) > built for path in self._index_files())
+
+    def build_sorted_index(self):
+        """Merges every .idx file into index.sorted, keeping the latest entry per provider.
+
+        Index files are read in name order (see default_prefix), so a provider
+        written by several runs resolves to its most recent record.
+        """
+        shard_ids = {}
+        ids, shards, offsets, lengths = array("Q"), array("I"), array("Q"), array("I")
+        for entry in self._iter_raw_entries():
+            ids.append(entry.provider_id)
+            shards.append(shard_ids.setdefault(entry.shard, len(shard_ids)))
+            offsets.append(entry.offset)
+            lengths.append(entry.length)
+
+        # Stable sort: for equal IDs the last written entry comes last
+        order = sorted(range(len(ids)), key=ids.__getitem__)
+        tmp_path = self._sorted_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            for position, i in enumerate(order):
+                if position + 1 < len(order) and ids[order[position + 1]] == ids[i]:
+                    continue
+                f.write(INDEX_RECORD.pack(ids[i], shards[i], offsets[i], lengths[i]))
+        with open(self._shard_table_path + ".tmp", "w", encoding="utf-8") as f:
+            f.write("".join(name + "\n" for name in shard_ids))
+        os.replace(self._shard_table_path + ".tmp", self._shard_table_path)
+        os.replace(tmp_path, self._sorted_path)
+
+    def _load_index(self):
+        with self._lock:
+            if self._index is not None:
+                return
+            if self._index_is_stale():
+                self.build_sorted_index()
+            with open(self._shard_table_path, "r", encoding="utf-8") as f:
+                self._shard_names = f.read().splitlines()
+            with open(self._sorted_path, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                self._index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def __len__(self):
+        self._load_index()
+        return len(self._index) // INDEX_RECORD.size
+
+    def _entry_at(self, position):
+        provider_id, shard, offset, length = INDEX_RECORD.unpack_from(self._index, position * INDEX_RECORD.size)
+        return IndexEntry(provider_id, self._shard_names[shard], offset, length)
+
+    def iter_entries(self):
+        """Yields the latest entry of every provider in storage order: shard by shard, by offset.
+
+        The .idx files list records in write order, so a full pass reads every
+        shard sequentially. Entries a later write superseded are skipped;
+        the sorted index decides which entry of a provider is current.
+        """
+        self._load_index()
+        for entry in self._iter_raw_entries():
+            if self.lookup(entry.provider_id) == entry:
+                yield entry
+
+    def lookup(self, provider_id):
+        """Binary-searches the sorted index; returns the IndexEntry or None."""
+        provider_id = int(provider_id)
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if ID_FIELD.unpack_from(self._index, mid * INDEX_RECORD.size)[0] < provider_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self):
+            entry = self._entry_at(lo)
+            if entry.provider_id == provider_id:
+                return entry
+        return None
+
+    def get(self, provider_id):
+        """Returns the raw record of one provider, or None if it is not stored."""
+        entry = self.lookup(provider_id)
+        return self.read(entry) if entry else None
+
+    def _shard_map(self, shard):
+        shard_map = self._maps.get(shard)
+        if shard_map is None:
+            with self._lock:
+                shard_map = self._maps.get(shard)
+                if shard_map is None:
+                    with open(os.path.join(self.directory, shard), "rb") as f:
+                        shard_map = self._maps[shard] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return shard_map
+
+    def read_bytes(self, entry):
+        shard_map = self._shard_map(entry.shard)
+        if entry.offset + entry.length > len(shard_map):
+            # The shard grew since it was mapped (a writer is still appending)
+            with self._lock:
+                self._maps.pop(entry.shard, None)
+            shard_map = self._shard_map(entry.shard)
+        return gzip.decompress(shard_map[entry.offset:entry.offset + entry.length])
+
+    def read(self, entry):
+        return serializer.loads(self.read_bytes(entry))
+
+    def close(self):
+        with self._lock:
+            for shard_map in self._maps.values():
+                shard_map.close()
+            self._maps = {}
+            if isinstance(self._index, mmap.mmap):
+                self._index.close()
+            self._index = None
@@ -0,0 +1,329 @@
+import os
+import json
+import time
+import socket
+import sqlite3
+import threading
+import requests
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class WorkQueue:
+    """Leased work units of URLs, shared by the crawl coordinator and its workers.
+
+    The coordinator splits the URL list into units; a worker claims one,
+    holds a lease on it while fetching (renew() extends it) and reports it
+    done. A unit whose lease expires, because its worker died or hung, goes
+    back to pending and is claimed again, up to `max_attempts` times.
+    State lives in one SQLite file, so the queue survives coordinator
+    restarts and can be shared directly by workers on the same machine.
+    A unit may carry a `done_since` time, handed to its worker with the
+    URLs: providers fetched before it are fetched again (incremental crawls).
+    """
+
+    def __init__(self, path, lease_seconds=600, max_attempts=5, clock=time.time):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.clock = clock
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS units (
+                unit_id INTEGER PRIMARY KEY,
+                urls TEXT NOT NULL,
+                status TEXT NOT NULL,
+                worker TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                result TEXT,
+                done_since REAL
+            )"""
+        )
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(units)")]
+        if "done_since" not in columns:
+            self.conn.execute("ALTER TABLE units ADD COLUMN done_since REAL")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS units_status ON units (status, unit_id)")
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so two processes
+        # sharing the file can never claim the same unit
+        self.conn.execute("BEGIN IMMEDIATE")
+
+    def add_units(self, urls, unit_size=1000, done_since=None):
+        """Splits `urls` (any iterable) into units of `unit_size`; returns how many were added."""
+        added = 0
+        batch = []
+        insert = "INSERT INTO units (urls, status, done_since) VALUES (?, ?, ?)"
+        with self._lock:
+            self._transaction()
+            try:
+                for url in urls:
+                    batch.append(url)
+                    if len(batch) == unit_size:
+                        self.conn.execute(insert, ("\n".join(batch), PENDING, done_since))
+                        added += 1
+                        batch = []
+                if batch:
+                    self.conn.execute(insert, ("\n".join(batch), PENDING, done_since))
+                    added += 1
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        return added
+
+    def _requeue_expired(self, now):
+        self.conn.execute(
+            "UPDATE units SET status = ?, worker = NULL WHERE status = ? AND lease_expires < ? AND attempts >= ?",
+            (FAILED, LEASED, now, self.max_attempts),
+        )
+        return self.conn.execute(
+            "UPDATE units SET status = ?, worker = NULL WHERE status = ? AND lease_expires < ?",
+            (PENDING, LEASED, now),
+        ).rowcount
+
+    def requeue_expired(self):
+        with self._lock:
+            self._transaction()
+            requeued = self._requeue_expired(self.clock())
+            self.conn.execute("COMMIT")
+        return requeued
+
+    def claim(self, worker_id):
+        """Leases the next pending unit to `worker_id`; returns (unit_id, urls, done_since) or None."""
+        with self._lock:
+            now = self.clock()
+            self._transaction()
+            try:
+                self._requeue_expired(now)
+                row = self.conn.execute(
+                    "SELECT unit_id, urls, done_since FROM units WHERE status = ? ORDER BY unit_id LIMIT 1", (PENDING,)
+                ).fetchone()
+                if row:
+                    self.conn.execute(
+                        "UPDATE units SET status = ?, worker = ?, lease_expires = ?, attempts = attempts + 1 WHERE unit_id = ?",
+                        (LEASED, worker_id, now + self.lease_seconds, row[0]),
+                    )
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        return row[0], row[1].split("\n"), row[2]
+
+    def _update_lease(self, unit_id, worker_id, assignments, params):
+        with self._lock:
+            return self.conn.execute(
+                f"UPDATE units SET {assignments} WHERE unit_id = ? AND worker = ? AND status = ?",
+                params + (unit_id, worker_id, LEASED),
+            ).rowcount == 1
+
+    def renew(self, unit_id, worker_id):
+        """Extends the lease; False if the unit was meanwhile given to another worker."""
+        return self._update_lease(unit_id, worker_id, "lease_expires = ?", (self.clock() + self.lease_seconds,))
+
+    def complete(self, unit_id, worker_id, result=None):
+        return self._update_lease(unit_id, worker_id, "status = ?, result = ?", (DONE, json.dumps(result)))
+
+    def release(self, unit_id, worker_id):
+        """Hands a unit back (e.g. its worker is shutting down) so another worker can take it."""
+        return self._update_lease(unit_id, worker_id, "status = ?, worker = NULL", (PENDING,))
+
+    def results(self, batch_size=100):
+        """Yields the result each completed unit was reported with, a batch of units at a time."""
+        last = -1
+        while True:
+            with self._lock:
+                rows = self.conn.execute(
+                    "SELECT unit_id, result FROM units WHERE status = ? AND unit_id > ? ORDER BY unit_id LIMIT ?",
+                    (DONE, last, batch_size),
+                ).fetchall()
+            if not rows:
+                return
+            for unit_id, result in rows:
+                yield json.loads(result) if result else None
+            last = rows[-1][0]
+
+    def clear(self):
+        """Drops every unit, e.g. once a finished crawl's results were collected."""
+        with self._lock:
+            self.conn.execute("DELETE FROM units")
+
+    def counts(self):
+        with self._lock:
+            return dict(self.conn.execute("SELECT status, COUNT(*) FROM units GROUP BY status"))
+
+    def is_finished(self):
+        counts = self.counts()
+        return not counts.get(PENDING) and not counts.get(LEASED)
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+class _QueueHandler(BaseHTTPRequestHandler):
+    queue = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/status":
+            return self._reply({"error": "not found"}, 404)
+        self._reply({
+            "counts": self.queue.counts(), "finished": self.queue.is_finished(),
+            "lease_seconds": self.queue.lease_seconds,
+        })
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        worker_id = request.get("worker_id")
+        if self.path == "/claim":
+            unit = self.queue.claim(worker_id)
+            return self._reply({
+                "unit": list(unit) if unit else None,
+                "finished": unit is None and self.queue.is_finished(),
+                # Workers renew against the coordinator's lease, not their own settings
+                "lease_seconds": self.queue.lease_seconds,
+            })
+        if self.path == "/renew":
+            return self._reply({"ok": self.queue.renew(request["unit_id"], worker_id)})
+        if self.path == "/complete":
+            return self._reply({"ok": self.queue.complete(request["unit_id"], worker_id, request.get("result"))})
+        if self.path == "/release":
+            return self._reply({"ok": self.queue.release(request["unit_id"], worker_id)})
+        self._reply({"error": "not found"}, 404)
+
+
+def serve_work_queue(queue, host="0.0.0.0", port=8765):
+    """Serves `queue` over HTTP for workers on other machines; returns the running server."""
+    handler = type("QueueHandler", (_QueueHandler,), {"queue": queue})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class RemoteWorkQueue:
+    """Worker-side client of serve_work_queue with the WorkQueue worker methods.
+
+    lease_seconds is the coordinator's, as reported by every claim.
+    """
+
+    def __init__(self, base_url, timeout=30):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+        self._finished = False
+        self.lease_seconds = None
+
+    def _post(self, path, **payload):
+        response = self.session.post(self.base_url + path, json=payload, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def claim(self, worker_id):
+        reply = self._post("/claim", worker_id=worker_id)
+        self._finished = reply["finished"]
+        self.lease_seconds = reply["lease_seconds"]
+        return tuple(reply["unit"]) if reply["unit"] else None
+
+    def renew(self, unit_id, worker_id):
+        return self._post("/renew", unit_id=unit_id, worker_id=worker_id)["ok"]
+
+    def complete(self, unit_id, worker_id, result=None):
+        return self._post("/complete", unit_id=unit_id, worker_id=worker_id, result=result)["ok"]
+
+    def release(self, unit_id, worker_id):
+        return self._post("/release", unit_id=unit_id, worker_id=worker_id)["ok"]
+
+    def is_finished(self):
+        return self._finished
+
+    def close(self):
+        self.session.close()
+
+
+def open_work_queue(location, **kwargs):
+    """A RemoteWorkQueue for an http(s):// URL, otherwise a WorkQueue on that SQLite file.
+
+    `kwargs` only apply to a WorkQueue; a remote queue's lease is set by its coordinator.
+    """
+    if location.startswith(("http://", "https://")):
+        return RemoteWorkQueue(location)
+    return WorkQueue(location, **kwargs)
+
+
+def run_worker(queue, process_unit, worker_id=None, poll_interval=10, renew_interval=None):
+    """Claims units until the queue is finished, calling process_unit(urls, done_since) on each.
+
+    A heartbeat thread renews the lease while the unit is processed, by
+    default three times per lease (the queue's lease_seconds, known once a
+    unit is claimed). A unit whose processing raises is released for
+    another worker.
+    """
+    worker_id = worker_id or default_worker_id()
+    processed = 0
+    while True:
+        unit = queue.claim(worker_id)
+        if unit is None:
+            if queue.is_finished():
+                break
+            # Every remaining unit is leased by someone else; one may expire
+            time.sleep(poll_interval)
+            continue
+
+        unit_id, urls, done_since = unit
+        print(f"Worker {worker_id} claimed unit {unit_id} ({len(urls)} URLs).")
+        interval = renew_interval or queue.lease_seconds / 3
+        stop = threading.Event()
+
+        def heartbeat():
+            while not stop.wait(interval):
+                if not queue.renew(unit_id, worker_id):
+                    print(f"Lost the lease on unit {unit_id}.")
+                    return
+
+        renewer = threading.Thread(target=heartbeat, daemon=True)
+        renewer.start()
+        try:
+            result = process_unit(urls, done_since)
+        except BaseException:
+            stop.set()
+            renewer.join()
+            queue.release(unit_id, worker_id)
+            raise
+        stop.set()
+        renewer.join()
+        if not queue.complete(unit_id, worker_id, result):
+            # Another worker took the unit over; its output is simply written twice
+            print(f"Unit {unit_id} was re-leased before it completed.")
+        processed += 1
+    print(f"Worker {worker_id} finished after {processed} units.")
+    return processed
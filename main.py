@@ -2,8 +2,17 @@ import os
 import logging
 import time
 from functions.search import SitemapFetcher
-from functions.mpc_formatter import JSONFormatter
-from functions.fetch_data_bulk import fetch_all_data
+from functions.mpc_formatter import JSONFormatter, FormatPipeline
+from functions.projection import FORMAT_PROJECTION
+from functions.fetch_data_bulk import FetchSettings, fetch_all_data, read_urls, count_urls, extract_provider_id, scrapeops_api_key, proxy_url, API_URL
+from functions.fetch_data_async import fetch_all_data_async
+from functions.rate_limiter import RateLimiter
+from functions.retry import RetryPolicy
+from functions.proxy_pool import ProxyPool
+from functions.dedup import dedupe_url_file
+from functions.metrics import MetricsReporter, setup_metrics_log, serve_metrics
+from functions.work_queue import WorkQueue, open_work_queue, serve_work_queue, run_worker
+from functions.checkpoint import CheckpointStore, open_checkpoint
 import argparse
 
 # Configure logging
@@ -33,6 +42,21 @@ def setup_logging(base_folder):
     success_logger.addHandler(success_handler)
     success_logger.setLevel(logging.INFO)
 
+    # Metrics snapshots, one JSON object per line
+    setup_metrics_log(os.path.join(logs_folder, "metrics.jsonl"))
+
+
+def record_unit_results(queue, output_directory):
+    """Records the successes the workers reported in the coordinator's checkpoint.
+
+    Workers fetch into their own output directories, so this is how the
+    coordinator learns what was crawled (and builds the next incremental delta).
+    """
+    with open_checkpoint(output_directory, extract_provider_id) as checkpoint:
+        for result in queue.results():
+            for provider_id, url, updated_at in (result or {}).get("succeeded", []):
+                checkpoint.record(provider_id, url, True, updated_at)
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Fetch Doctors From Zocdoc Website.')
@@ -40,30 +64,157 @@ if __name__ == "__main__":
     parser.add_argument('--output_dir', '-o', type=str, required=True, help='Directory to save the output')
     parser.add_argument('--format_only', '-f', action='store_true', help='Only format the output directory')
     parser.add_argument('--threads', '-t', type=int, default=10, help='No. of concurrent processes to run (default: 5)')
+    parser.add_argument('--format_mode', choices=['threads', 'processes'], default='threads', help='Run the formatter on a thread pool or a process pool using all cores (default: threads)')
+    parser.add_argument('--format_workers', type=int, default=None, help='Formatter processes for --format_mode processes (default: CPU count)')
+    parser.add_argument('--compact', action='store_true', help='Write raw and formatted JSON without indentation')
+    parser.add_argument('--storage', choices=['files', 'shards', 'none'], default='files', help="Store raw records as one file each, in compressed JSONL shards, or not at all ('none' needs --stream_format) (default: files)")
+    parser.add_argument('--stream_format', '-s', action='store_true', help='Format each payload as soon as it is fetched instead of in a separate pass')
+    parser.add_argument('--ids', type=str, default=None, help='File with provider IDs (one per line) to re-format; implies --format_only')
+    parser.add_argument('--incremental', action='store_true', help='Only fetch providers that are new or changed in the sitemaps since the last crawl (no effect with --input_urls)')
+    parser.add_argument('--engine', '-e', choices=['threads', 'async'], default='threads', help='Fetch engine: thread pool or asyncio (default: threads)')
+    parser.add_argument('--concurrency', '-c', type=int, default=1000, help='Max URLs in flight for the async engine (default: 1000)')
+    parser.add_argument('--connections_per_host', type=int, default=100, help='Keep-alive connections per host for the async engine (default: 100)')
+    parser.add_argument('--rate', '-r', type=float, default=1.0, help='Target requests/second per host shared by all workers (default: 1.0)')
+    parser.add_argument('--burst', type=int, default=5, help='Requests allowed back to back per host (default: 5)')
+    parser.add_argument('--html', choices=['pretty', 'raw', 'none'], default='pretty', help="Provider page handling: prettified HTML, raw bytes, or 'none' for API-only (default: pretty)")
+    parser.add_argument('--max_rate', type=float, default=None, help='Ceiling for adaptive speed-up in requests/second per host (default: --rate)')
+    parser.add_argument('--max_attempts', type=int, default=5, help='Attempts per URL for throttled or transient failures; permanent 4xx errors are not retried (default: 5)')
+    parser.add_argument('--timeout', type=float, default=30, help='Read timeout in seconds for every request (default: 30)')
+    parser.add_argument('--proxies', type=str, default=None, help='File with proxy URLs (one per line) to rotate requests over')
+    parser.add_argument('--scrapeops_key', type=str, default=os.environ.get('SCRAPEOPS_API_KEY', scrapeops_api_key), help='Send requests through the ScrapeOps proxy API with this key (default: $SCRAPEOPS_API_KEY)')
+    parser.add_argument('--source', choices=['api', 'page'], default='api', help="Take provider data from the API or from the state embedded in the provider page (default: api)")
+    parser.add_argument('--no_dedup', action='store_true', help='Fetch every URL as listed instead of one URL per provider ID')
+    parser.add_argument('--coordinator', type=str, default=None, metavar='[HOST:]PORT', help='Split the URL list into work units and serve them to --worker processes instead of fetching')
+    parser.add_argument('--worker', type=str, default=None, metavar='QUEUE', help='Fetch work units from a coordinator URL (http://host:port) or a shared work_queue.db file')
+    parser.add_argument('--unit_size', type=int, default=1000, help='URLs per work unit in --coordinator mode (default: 1000)')
+    parser.add_argument('--lease', type=float, default=600, help='Seconds a worker holds a unit before it is handed to another worker; set on the coordinator (or a worker sharing a work_queue.db file), HTTP workers use the coordinator\'s (default: 600)')
+    parser.add_argument('--base_url', type=str, default='https://www.opencare.com', help='Site serving the sitemaps, e.g. a local stand-in server (default: https://www.opencare.com)')
+    parser.add_argument('--api_url', type=str, default=API_URL, help='Provider API URL template with a {provider_id} placeholder (default: %(default)s)')
+    parser.add_argument('--metrics_interval', type=float, default=30, help='Seconds between JSON metrics snapshots in output_dir/logs/metrics.jsonl, 0 to disable (default: 30)')
+    parser.add_argument('--metrics_port', type=int, default=None, help='Serve live metrics as JSON on http://127.0.0.1:PORT/metrics')
+    parser.add_argument('--full_archive', action='store_true', help='Store complete API responses instead of only the fields the formatter reads')
+    parser.add_argument('--proxy_cooldown', type=float, default=60, help='Seconds an unhealthy proxy stays out of rotation, doubling on repeats (default: 60)')
     
     args = parser.parse_args()
+    if args.storage == 'none' and not args.stream_format:
+        parser.error("--storage none discards raw data, so it requires --stream_format")
+    if args.coordinator and args.worker:
+        parser.error("--coordinator and --worker are separate processes")
 
     urls_file = args.input_urls
     output_directory = args.output_dir
+    # Raw records keep only what format_json reads, unless a full archive is wanted
+    projection = None if args.full_archive else FORMAT_PROJECTION
 
     setup_logging(output_directory)
-    
-    if not args.format_only:
-        # First Step : if no existing urls to extract, go fetch all urls either from sitemap or website search page
-        if not urls_file:
-            fetcher = SitemapFetcher(output_dir=output_directory)
-            fetcher.fetch_and_extract_sitemaps()
-            urls_file = os.path.join(output_directory, "all_urls.txt")
-
-        with open(urls_file, 'r') as f:
-            urls = [line.strip() for line in f if line.strip()]
-        
+    reporter = MetricsReporter(interval=args.metrics_interval) if args.metrics_interval > 0 else None
+    if reporter:
+        reporter.start()
+    if args.metrics_port:
+        serve_metrics(port=args.metrics_port)
+
+    if args.coordinator:
+        # Distributed crawl: hand the URL list out in leased units and wait for the workers
+        host, _, port = args.coordinator.rpartition(':')
+        with WorkQueue(os.path.join(output_directory, "work_queue.db"), lease_seconds=args.lease) as queue:
+            if queue.counts() and queue.is_finished():
+                # A crawl that finished before its results were collected
+                record_unit_results(queue, output_directory)
+                queue.clear()
+            if not queue.counts():
+                done_since = None
+                if not urls_file:
+                    done_since = time.time() if args.incremental else None
+                    with SitemapFetcher(["doctor"], output_dir=output_directory, incremental=args.incremental, base_url=args.base_url) as fetcher:
+                        fetcher.fetch_and_save_sitemaps()
+                    urls_file = fetcher.output_file
+                if not args.no_dedup:
+                    urls_file = dedupe_url_file(urls_file)
+                # Workers refetch the listed providers they fetched before the delta was built
+                print(f"Created {queue.add_units(read_urls(urls_file), args.unit_size, done_since)} work units.")
+            server = serve_work_queue(queue, host or '0.0.0.0', int(port))
+            print(f"Serving work units on port {port}: {queue.counts()}")
+            while not queue.is_finished():
+                time.sleep(10)
+                queue.requeue_expired()
+                print(f"Work units: {queue.counts()}")
+            server.shutdown()
+            success_logger.info(f"All work units finished: {queue.counts()}")
+            record_unit_results(queue, output_directory)
+            queue.clear()
+
+    elif not args.format_only and not args.ids:
+        done_since = None
+        if not args.worker:
+            # First Step : if no existing urls to extract, go fetch all urls either from sitemap or website search page
+            if not urls_file:
+                # In incremental mode the listed providers fetched before the delta was built are refetched
+                done_since = time.time() if args.incremental else None
+                with SitemapFetcher(["doctor"], output_dir=output_directory, incremental=args.incremental, base_url=args.base_url) as fetcher:
+                    fetcher.fetch_and_save_sitemaps()
+                urls_file = fetcher.output_file
+            # One URL per provider ID, so no provider is fetched twice under different URLs
+            if not args.no_dedup:
+                urls_file = dedupe_url_file(urls_file)
+
         start_time = time.time()
+        formatter = JSONFormatter(output_directory, mode=args.format_mode, processes=args.format_workers, compact=args.compact, storage=args.storage, projection=FORMAT_PROJECTION)
+        # With --stream_format each payload is formatted as soon as it is fetched
+        pipeline = FormatPipeline(formatter) if args.stream_format else None
+        on_payload = pipeline.submit if pipeline else None
         # Second Step : get all urls and fetch their html & json data and save it to output_dir/raw_data folder
-        fetch_all_data(urls, os.path.join(output_directory), args.threads)
+        rate_limiter = RateLimiter(rate=args.rate, burst=args.burst, max_rate=args.max_rate)
+        retry_policy = RetryPolicy(max_attempts=args.max_attempts, timeout=(10, args.timeout))
+        proxy_pool = None
+        if args.proxies:
+            proxy_pool = ProxyPool.from_file(args.proxies, cooldown=args.proxy_cooldown)
+        elif args.scrapeops_key:
+            proxy_pool = ProxyPool.scrapeops(args.scrapeops_key, proxy_url, cooldown=args.proxy_cooldown)
+
+        settings = FetchSettings(
+            output_directory, rate_limiter=rate_limiter, html_mode=args.html, storage=args.storage,
+            compact=args.compact, done_since=done_since, on_payload=on_payload, retry_policy=retry_policy,
+            proxy_pool=proxy_pool, source=args.source, api_url=args.api_url, projection=projection,
+        )
+
+        def fetch(urls, total):
+            if args.engine == 'async':
+                fetch_all_data_async(urls, settings, args.concurrency, args.connections_per_host, total=total)
+            else:
+                fetch_all_data(urls, settings, args.threads, total=total)
+            return {"urls": total}
+
+        def fetch_unit(urls, unit_done_since):
+            # The coordinator's done_since, so providers it listed as changed are refetched here
+            settings.done_since = unit_done_since
+            result = fetch(urls, len(urls))
+            # Reported back for the coordinator's checkpoint
+            with CheckpointStore(os.path.join(output_directory, "checkpoint.db")) as checkpoint:
+                result["succeeded"] = list(checkpoint.successes(urls, extract_provider_id, unit_done_since))
+            return result
+
+        if args.worker:
+            # Distributed crawl: fetch the units leased from the coordinator into the local output_dir
+            queue = open_work_queue(args.worker, lease_seconds=args.lease)
+            run_worker(queue, fetch_unit)
+            queue.close()
+        else:
+            # Streamed lazily so memory stays flat whatever the size of the URL list;
+            # counting it first is a second streamed pass
+            fetch(read_urls(urls_file), count_urls(urls_file))
+        if pipeline:
+            pipeline.close()
         elapsed_time = time.time() - start_time
         success_logger.info(f"All URLs scraped successfully in {elapsed_time:.2f} seconds.")
 
     # # Third Step : format the raw data to a structured format and save it to output_dir/formatted folder
-    formatter = JSONFormatter(output_directory)
-    formatter.process_directory()
\ No newline at end of file
+    if args.ids:
+        formatter = JSONFormatter(output_directory, mode=args.format_mode, processes=args.format_workers, compact=args.compact, storage=args.storage, overwrite=True, projection=FORMAT_PROJECTION)
+        with open(args.ids, 'r') as f:
+            formatter.process_ids([line.strip() for line in f if line.strip()])
+    elif args.format_only or not (args.stream_format or args.coordinator):
+        formatter = JSONFormatter(output_directory, mode=args.format_mode, processes=args.format_workers, compact=args.compact, storage=args.storage, projection=FORMAT_PROJECTION)
+        formatter.process_directory()
+
+    if reporter:
+        reporter.stop()